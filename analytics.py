@@ -1,6 +1,7 @@
 import datetime as datetime
 import locale
 import math
+import threading
 import typing as t
 import warnings
 
@@ -15,10 +16,16 @@ import dominate.tags as dom
 from folium import plugins
 from mlxtend.frequent_patterns import apriori, association_rules
 
+import chart_data as cd
+from order_index import OrderIndex
+
 warnings.filterwarnings("ignore")
-alt.data_transformers.enable("default", max_rows=None)
+# charts are built from server-side aggregates only, see `chart_data`
+cd.enable()
 # Set currency
 locale.setlocale(locale.LC_ALL, "en_US.UTF-8")
+# pyplot keeps global "current figure" state, serialise its use across render threads
+pyplot_lock = threading.Lock()
 
 
 def set_timezones(df: pd.DataFrame, cols: t.List[str]) -> None:
@@ -40,14 +47,51 @@ def get_window(
     return window, previous_period_window
 
 
-def summary_stats(df_orders: pd.DataFrame, df_customers: pd.DataFrame) -> pd.DataFrame:
+def resolve_window(
+    df_orders: pd.DataFrame,
+    start_date: t.Optional[datetime.date],
+    end_date: t.Optional[datetime.date],
+    all_data: bool,
+) -> t.Tuple[pd.Timestamp, pd.Timestamp]:
+    # the dates are ignored for "All Data"
+    if all_data:
+        window_start = df_orders["Created at"].min() + datetime.timedelta(weeks=1)
+        window_end = df_orders["Created at"].max()
+    else:
+        window_start = pd.to_datetime(start_date).tz_localize("US/Pacific")
+        window_end = pd.to_datetime(end_date).tz_localize("US/Pacific")
+    return window_start, window_end
+
+
+def default_window(today: datetime.date) -> t.Tuple[datetime.date, datetime.date]:
+    # the form's initial dates, the last 26 weeks
+    return today - datetime.timedelta(weeks=26), today
+
+
+def standard_windows(today: datetime.date) -> t.List[t.Tuple[datetime.date, datetime.date, bool]]:
+    # last 7 / 30 days, the default form window and "All Data"
+    return [
+        (today - datetime.timedelta(days=7), today, False),
+        (today - datetime.timedelta(days=30), today, False),
+        (*default_window(today), False),
+        (today, today, True),
+    ]
+
+
+def summary_stats(
+    df_orders: pd.DataFrame, df_customers: pd.DataFrame, distinct_customers: t.Optional[float] = None
+) -> pd.DataFrame:
+    # `distinct_customers` lets callers supply an (approximate) count rather than hashing every order
+    if distinct_customers is None:
+        distinct_customers = len(df_orders.Cust_ID.unique())
+
     stats = {}
     stats["orders"] = len(df_orders)
     stats["sales"] = len(df_orders[df_orders["Financial Status"] == "paid"])
     stats["aov"] = df_orders.Total.mean()
     stats["revenue"] = df_orders.Total.sum()
     stats["new_customers"] = len(df_customers)
-    stats["returning_customers"] = len(df_orders.Cust_ID.unique()) - stats["new_customers"]
+    stats["returning_customers"] = round(distinct_customers) - stats["new_customers"]
     return pd.DataFrame.from_dict(stats, orient="index").T
 
 
@@ -56,9 +100,18 @@ def get_summary_stats(
     df_customers_window: pd.DataFrame,
     df_orders_window_previous: pd.DataFrame,
     df_customers_window_previous: pd.DataFrame,
+    distinct_customers: t.Tuple[t.Optional[float], t.Optional[float]] = (None, None),
+) -> t.Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    stats_current_period = summary_stats(df_orders_window, df_customers_window, distinct_customers[0])
+    stats_previous_period = summary_stats(
+        df_orders_window_previous, df_customers_window_previous, distinct_customers[1]
+    )
+    return compare_periods(stats_current_period, stats_previous_period)
+
+
+def compare_periods(
+    stats_current_period: pd.DataFrame, stats_previous_period: pd.DataFrame
 ) -> t.Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-    stats_current_period = summary_stats(df_orders_window, df_customers_window)
-    stats_previous_period = summary_stats(df_orders_window_previous, df_customers_window_previous)
     stats_delta = stats_current_period - stats_previous_period
     stats_upward_change = stats_delta > 0
 
@@ -90,12 +143,16 @@ def plot_customer_locations(
 
 
 def plot_aov_histogram_orig(df: pd.DataFrame) -> alt.Chart:
+    # Bin server-side rather than embedding every order in the spec
+    binned = cd.histogram_frame(df["Total"], cd.nice_bins(df["Total"]))
+
     fig = (
-        alt.Chart(df)
+        alt.Chart(binned)
         .mark_bar(color="#00B3FE")
         .encode(
-            alt.X("Total:Q", bin=True, axis=alt.Axis(format="$f"), title=None),
-            alt.Y("count()", title=None),
+            alt.X("bin_min:Q", bin="binned", axis=alt.Axis(format="$f"), title=None),
+            x2="bin_max",
+            y=alt.Y("count:Q", title=None),
         )
         .properties(title=f"Average order value {locale.currency(df.Total.mean(), grouping=True)}")
     )
@@ -110,8 +167,8 @@ def plot_aov_histogram(df: pd.DataFrame) -> alt.Chart:
     # Bin the data using pd.cut() with the calculated bins
     binned_data = pd.cut(df["Total"], bins=bins)
 
-    # Group by the bins and count the number of items in each bin
-    binned = df.groupby(binned_data).count()
+    # Group by the bins and count the number of items in each bin, only `Total` is plotted
+    binned = df["Total"].groupby(binned_data).count().to_frame()
     binned["bin_min"] = bins[:-1]
     binned["bin_max"] = bins[1:]
     binned = binned.reset_index(drop=True)
@@ -154,11 +211,22 @@ def to_unordered_list(items: t.List[str]) -> str:
     return unordered_list.render(pretty=False)
 
 
-def frequent_product_combinations(df_items_window: pd.DataFrame) -> pd.DataFrame:
-    one_hot_encoded = (pd.get_dummies(df_items_window["Lineitem name"]).groupby("Name").sum()).clip(upper=1)
+def frequent_product_combinations(
+    df_items_window: pd.DataFrame, order_index: t.Optional[OrderIndex] = None
+) -> pd.DataFrame:
+    return style_product_combinations(product_combinations(df_items_window, order_index))
 
-    # filter for only orders with 2 or more items
-    one_hot_encoded_filtered = one_hot_encoded[one_hot_encoded.sum(axis=1) >= 2]
+
+def product_combinations(df_items_window: pd.DataFrame, order_index: t.Optional[OrderIndex] = None) -> pd.DataFrame:
+    if order_index is not None:
+        # slice the prebuilt order -> products index rather than regrouping the line items
+        orders = order_index.positions(df_items_window.index)
+        one_hot_encoded_filtered = order_index.one_hot(orders[order_index.basket_sizes(orders) >= 2])
+    else:
+        one_hot_encoded = (pd.get_dummies(df_items_window["Lineitem name"]).groupby("Name").sum()).clip(upper=1)
+
+        # filter for only orders with 2 or more items
+        one_hot_encoded_filtered = one_hot_encoded[one_hot_encoded.sum(axis=1) >= 2]
 
     frequent_itemsets = apriori(one_hot_encoded_filtered, min_support=0.025, use_colnames=True).sort_values(
         "support", ascending=False
@@ -187,6 +255,10 @@ def frequent_product_combinations(df_items_window: pd.DataFrame) -> pd.DataFrame
 
     frequent_combinations.index = frequent_combinations.index + 1
 
+    return frequent_combinations
+
+
+def style_product_combinations(frequent_combinations: pd.DataFrame) -> pd.DataFrame:
     frequent_combinations = frequent_combinations.style.set_properties(
         **{
             "text-align": "left",
@@ -211,103 +283,101 @@ def frequent_product_combinations(df_items_window: pd.DataFrame) -> pd.DataFrame
     return frequent_combinations
 
 
-def get_month(x: datetime.datetime) -> datetime.datetime:
-    return datetime.datetime(x.year, x.month, 1)
-
-
-def cohort_analysis(
-    df_orders_window: pd.DataFrame,
-) -> t.Tuple[matplotlib.figure.Figure, matplotlib.figure.Figure]:
-    df_orders_cohort = df_orders_window
-
-    df_orders_cohort["order_month"] = df_orders_cohort["Created at"].apply(get_month)
-
-    grouping = df_orders_cohort.groupby("Cust_ID")["order_month"]
-
-    df_orders_cohort["cohort_month"] = grouping.transform("min")
+def order_months(created_at: pd.Series) -> pd.Series:
+    """The first of each order's month, in the frames' time zone (UTC)"""
+    return created_at.dt.tz_localize(None).dt.to_period("M").dt.to_timestamp()
 
-    def get_date_int(df: pd.DataFrame, column: str) -> t.Tuple[int, int, int]:
-        year = df[column].dt.year
-        month = df[column].dt.month
-        day = df[column].dt.day
-        return year, month, day
 
-    # Getting the integers for date parts from the `InvoiceDay` column
-    transcation_year, transaction_month, _ = get_date_int(df_orders_cohort, "order_month")
+def cohort_cells(df_orders: pd.DataFrame, cohort_months: t.Optional[pd.Series] = None) -> pd.DataFrame:
+    """
+    Unique customers, order total and order count per (cohort_month, cohort_index) cell.
+    A customer's cohort is their first month in `df_orders`, unless given in `cohort_months` (Cust_ID -> month).
+    """
+    order_month = order_months(df_orders["Created at"])
+    cohort_month = order_month.groupby(df_orders["Cust_ID"]).transform("min")
+    if cohort_months is not None:
+        cohort_month = df_orders["Cust_ID"].map(cohort_months).fillna(cohort_month)
 
-    # Getting the integers for date parts from the `CohortDay` column
-    cohort_year, cohort_month, _ = get_date_int(df_orders_cohort, "cohort_month")
+    #  Get the difference in years and months
+    years_diff = order_month.dt.year - cohort_month.dt.year
+    months_diff = order_month.dt.month - cohort_month.dt.month
 
-    #  Get the  difference in years
-    years_diff = transcation_year - cohort_year
-
-    # Calculate difference in months
-    months_diff = transaction_month - cohort_month
-
-    df_orders_cohort["cohort_index"] = years_diff * 12 + months_diff + 1
-
-    # Counting daily active user from each chort
-    grouping = df_orders_cohort.groupby(["cohort_month", "cohort_index"])
+    df_orders_cohort = pd.DataFrame(
+        {
+            "cohort_month": cohort_month,
+            "cohort_index": years_diff * 12 + months_diff + 1,
+            "Cust_ID": df_orders["Cust_ID"],
+            "Total": df_orders["Total"],
+        }
+    )
 
     # Counting number of unique customer Id's falling in each group of CohortMonth and CohortIndex
-    cohort_data = grouping["Cust_ID"].apply(pd.Series.nunique)
-    cohort_data = cohort_data.reset_index()
+    grouping = df_orders_cohort.groupby(["cohort_month", "cohort_index"])
+    return grouping.agg(customers=("Cust_ID", "nunique"), total=("Total", "sum"), orders=("Total", "count"))
 
-    # Assigning column names to the dataframe created above
-    cohort_counts = cohort_data.pivot(index="cohort_month", columns="cohort_index", values="Cust_ID")
 
+def cohort_matrices(cells: pd.DataFrame) -> t.Tuple[pd.DataFrame, pd.DataFrame]:
+    """Retention rate and average order total per cohort month (rows) and index (columns)"""
     ### Retention rate
+    cohort_counts = cells["customers"].unstack("cohort_index")
     cohort_sizes = cohort_counts.iloc[:, 0]
     retention = cohort_counts.divide(cohort_sizes, axis=0)
     retention.index = retention.index.strftime("%Y-%m")
 
-    retention_fig = plt.figure(figsize=(16, 10))
-    plt.rc("font", size=20)
-    plt.title(
-        "Retention Rate in percentage: Monthly Cohorts",
-    )
-    use_annotations = len(retention) <= 10
-    sns.heatmap(
-        retention,
-        annot=use_annotations,
-        fmt=".0%",
-        cmap="cividis_r",
-        vmin=0.0,
-        vmax=0.6,
-    )
-    plt.ylabel(
-        "Cohort Month",
-    )
-    plt.xlabel(
-        "Cohort Index",
-    )
-    plt.yticks(rotation=360)
-    plt.close()
-
     ### Average order total monthly cohort
-    grouping = df_orders_cohort.groupby(["cohort_month", "cohort_index"])
-    cohort_data = grouping["Total"].mean()
-    cohort_data = cohort_data.reset_index()
-    average_order = cohort_data.pivot(index="cohort_month", columns="cohort_index", values="Total")
-
+    average_order = (cells["total"] / cells["orders"]).unstack("cohort_index")
     average_standard_cost = average_order.round(1)
     average_standard_cost.index = average_standard_cost.index.strftime("%Y-%m")
 
-    avg_order_fig = plt.figure(figsize=(16, 10))
+    return retention, average_standard_cost
 
-    plt.title("Average Order Total: Monthly Cohorts")
-    sns.heatmap(
-        average_standard_cost,
-        annot=use_annotations,
-        vmin=0.0,
-        vmax=60,
-        cmap="cividis_r",
-        fmt="g",
-    )
-    plt.ylabel("Cohort Month")
-    plt.xlabel("Cohort Index")
-    plt.yticks(rotation=360)
-    plt.xticks(fontsize=20)
-    plt.close()
+
+def cohort_analysis(df_orders_window: pd.DataFrame) -> t.Tuple[matplotlib.figure.Figure, matplotlib.figure.Figure]:
+    return plot_cohorts(*cohort_matrices(cohort_cells(df_orders_window)))
+
+
+def plot_cohorts(
+    retention: pd.DataFrame, average_standard_cost: pd.DataFrame
+) -> t.Tuple[matplotlib.figure.Figure, matplotlib.figure.Figure]:
+    with pyplot_lock:
+        retention_fig = plt.figure(figsize=(16, 10))
+        plt.rc("font", size=20)
+        plt.title(
+            "Retention Rate in percentage: Monthly Cohorts",
+        )
+        use_annotations = len(retention) <= 10
+        sns.heatmap(
+            retention,
+            annot=use_annotations,
+            fmt=".0%",
+            cmap="cividis_r",
+            vmin=0.0,
+            vmax=0.6,
+        )
+        plt.ylabel(
+            "Cohort Month",
+        )
+        plt.xlabel(
+            "Cohort Index",
+        )
+        plt.yticks(rotation=360)
+        plt.close()
+
+        avg_order_fig = plt.figure(figsize=(16, 10))
+
+        plt.title("Average Order Total: Monthly Cohorts")
+        sns.heatmap(
+            average_standard_cost,
+            annot=use_annotations,
+            vmin=0.0,
+            vmax=60,
+            cmap="cividis_r",
+            fmt="g",
+        )
+        plt.ylabel("Cohort Month")
+        plt.xlabel("Cohort Index")
+        plt.yticks(rotation=360)
+        plt.xticks(fontsize=20)
+        plt.close()
 
     return retention_fig, avg_order_fig
@@ -0,0 +1,383 @@
+"""
+The report blocks for a window - the summary, top products, audiences and the heavy tabs.
+
+Shared by the app, the scheduled reports (`reports`) and the cache warmer (`tasks`), so none
+of them has to import the app's entrypoint.
+"""
+import locale
+import os
+import textwrap
+import typing as t
+
+import datapane as dp
+import numpy as np
+import pandas as pd
+from datapane_components import calendar_heatmap, section
+
+import analytics as a
+import cohorts
+import profiling
+import segmentation
+from results_cache import window_key
+from snapshots import Snapshot
+
+# Approximate distinct-customer counts from per-day HyperLogLog sketches, see `sketches` for error bounds.
+# With a database DuckDB still computes the other stats, only the distinct customers come from the sketches.
+APPROX_DISTINCT = os.environ.get("APPROX_DISTINCT", "0") == "1"
+
+
+################################################################################
+# Summary stats
+# 30 day stats (sales, aov, new customers, new orders, etc.)
+def summary_stats(
+    snap: Snapshot,
+    df_orders_window: pd.DataFrame,
+    df_customers_window: pd.DataFrame,
+    df_orders_window_previous: pd.DataFrame,
+    df_customers_window_previous: pd.DataFrame,
+    window_start: pd.Timestamp,
+    window_end: pd.Timestamp,
+) -> t.Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    if snap.db is not None:
+        stats = snap.db.summary_stats(window_start, window_end)
+        if APPROX_DISTINCT:
+            # the other stats stay exact, only the distinct customers come from the sketches
+            counts = distinct_customer_counts(snap, window_start, window_end)
+            for period_stats, distinct_customers in zip(stats, counts):
+                period_stats["returning_customers"] = round(distinct_customers) - period_stats["new_customers"]
+        return a.compare_periods(*stats)
+
+    # the sketches are only merged on a cache miss
+    distinct_customers = (None, None)
+    if APPROX_DISTINCT:
+        distinct_customers = distinct_customer_counts(snap, window_start, window_end)
+
+    return a.get_summary_stats(
+        df_orders_window,
+        df_customers_window,
+        df_orders_window_previous,
+        df_customers_window_previous,
+        distinct_customers,
+    )
+
+
+def distinct_customer_counts(
+    snap: Snapshot, window_start: pd.Timestamp, window_end: pd.Timestamp
+) -> t.Tuple[float, float]:
+    """Approximate distinct customers of the window and the previous one"""
+    previous_start = window_start - (window_end - window_start)
+    return (
+        snap.customer_sketches.count(window_start, window_end),
+        snap.customer_sketches.count(previous_start, window_start),
+    )
+
+
+def summary_key(window_start: pd.Timestamp, window_end: pd.Timestamp) -> str:
+    # exact and approximate stats are cached apart
+    return window_key(window_start, window_end, APPROX_DISTINCT)
+
+
+def gen_summary_stats(
+    snap: Snapshot,
+    df_orders_window: pd.DataFrame,
+    df_customers_window: pd.DataFrame,
+    df_orders_window_previous: pd.DataFrame,
+    df_customers_window_previous: pd.DataFrame,
+    window_start: pd.Timestamp,
+    window_end: pd.Timestamp,
+) -> dp.Group:
+    (
+        stats_current_period,
+        stats_previous_period,
+        stats_delta,
+        stats_upward_change,
+    ) = snap.results.cached(
+        "summary_stats",
+        summary_key(window_start, window_end),
+        summary_stats,
+        snap,
+        df_orders_window,
+        df_customers_window,
+        df_orders_window_previous,
+        df_customers_window_previous,
+        window_start,
+        window_end,
+    )
+
+    block_summary_stats = dp.Group(
+        dp.BigNumber(
+            "Orders Created",
+            f"{stats_current_period['orders'].item():n}",
+            f"{stats_delta['orders'].item():n}",
+            is_upward_change=stats_upward_change["orders"].item(),
+        ),
+        dp.BigNumber(
+            "Sales Completed",
+            f"{stats_current_period['sales'].item():n}",
+            f"{stats_delta['sales'].item():n}",
+            is_upward_change=stats_upward_change["sales"].item(),
+        ),
+        dp.BigNumber(
+            "New Customers",
+            f"{stats_current_period['new_customers'].item():n}",
+            f"{stats_delta['new_customers'].item():n}",
+            is_upward_change=stats_upward_change["new_customers"].item(),
+        ),
+        dp.BigNumber(
+            "Returning Customers",
+            f"{stats_current_period['returning_customers'].item():n}",
+            f"{stats_delta['returning_customers'].item():n}",
+            is_upward_change=stats_upward_change["returning_customers"].item(),
+        ),
+        dp.BigNumber(
+            "Revenue Generated",
+            locale.currency(stats_current_period["revenue"].item(), grouping=True),
+            locale.currency(stats_delta["revenue"].item(), grouping=True),
+            is_upward_change=stats_upward_change["revenue"].item(),
+        ),
+        dp.BigNumber(
+            "AOV",
+            locale.currency(stats_current_period["aov"].item(), grouping=True),
+            locale.currency(stats_delta["aov"].item(), grouping=True),
+            is_upward_change=stats_upward_change["aov"].item(),
+        ),
+        columns=3,
+    )
+    return block_summary_stats
+
+
+################################################################################
+# Audiences
+# Top 10% of customers, Most frequent purchasers, top country, top product, etc.
+def gen_audiencce_plots(df_orders_window: pd.DataFrame) -> dp.Group:
+    orders_by_customer = (
+        (df_orders_window["Cust_ID"].value_counts().value_counts().rename_axis("unique_values").to_frame("counts"))
+        .reset_index()
+        .rename(columns={0: "counts"})
+    )
+
+    orders_by_day = (
+        (df_orders_window["Created at"].dt.day_name().value_counts().rename_axis("unique_values").to_frame("counts"))
+        .reindex(["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"])
+        .reset_index()
+        .rename(columns={0: "counts"})
+    )
+
+    audience_plots = dp.Group(
+        dp.Plot(
+            a.plot_value_counts(
+                orders_by_customer,
+                title=f"Total number of orders: {len(df_orders_window)}",
+                bar_color="#5A5BC1",
+                scale="log",
+            )
+        ),
+        dp.Plot(a.plot_value_counts(orders_by_day, title="Orders by day of week", bar_color="#E7088E")),
+        dp.Plot(a.plot_aov_histogram(df_orders_window)),
+        columns=3,
+    )
+
+    return audience_plots
+
+
+################################################################################
+# Top Product (Big Numbers)
+def top_value(values: pd.Series, n: int = 0) -> str:
+    """The `n`th most common value, or the least common one when there are fewer"""
+    counts = values.value_counts()
+    # a categorical counts every category, including the ones not in `values`
+    counts = counts[counts > 0]
+    return str(counts.index[min(n, len(counts) - 1)]) if len(counts) else "-"
+
+
+def gen_top_product_stats(
+    snap: Snapshot, df_items_window: pd.DataFrame, df_orders_window: pd.DataFrame, df_customers_window: pd.DataFrame
+) -> dp.Group:
+    df_zipcode_lookup = snap.zipcode_lookup.frame
+    plot_customer_locations = a.plot_customer_locations(df_customers_window, 20, df_zipcode_lookup)
+
+    top_product = textwrap.shorten(top_value(df_items_window["Lineitem name"]), width=20, placeholder="...")
+    bn_top_product = dp.BigNumber("Top Product", top_product)
+
+    # Top SKU
+    top_sku = top_value(df_items_window["Lineitem sku"], 2)
+    bn_top_sku = dp.BigNumber("Top SKU", top_sku)
+
+    # Top Discount Code
+    top_discount_code = top_value(df_items_window["Discount Code"], 2)
+    bn_top_discount_code = dp.BigNumber("Top Discount Code", top_discount_code)
+
+    # Top City
+    zip_keys = snap.zipcode_lookup.zip_keys(df_orders_window["Shipping Zip"])
+    zip_keys = np.unique(zip_keys[zip_keys >= 0])
+
+    top_city = top_value(df_zipcode_lookup.iloc[zip_keys]["place_name"])
+    bn_top_city = dp.BigNumber("Top City", top_city)
+
+    audience_tops = dp.Group(
+        bn_top_product,
+        bn_top_discount_code,
+        bn_top_sku,
+        bn_top_city,
+    )
+
+    return dp.Group(plot_customer_locations, dp.Empty(name="zyz"), audience_tops, columns=2, widths=[2, 1])
+
+
+################################################################################
+# Market Basket
+# Frequency of popular items
+@profiling.profiled("popular_items")
+def gen_popular_items(snap: Snapshot, df_items_window: pd.DataFrame, key: str) -> dp.Group:
+    top_10_products = (
+        df_items_window["Lineitem name"]
+        .value_counts()
+        .rename_axis("unique_values")
+        .to_frame("counts")
+        .reset_index()
+        .rename(columns={0: "counts"})
+        .head(10)
+    )
+
+    # Item combinations per order. Start with one-hot encoding.
+    frequent_combinations = a.style_product_combinations(
+        snap.results.cached("product_combinations", key, a.product_combinations, df_items_window, snap.order_index)
+    )
+
+    popular = dp.Group(
+        dp.Table(frequent_combinations),
+        dp.Plot(a.plot_value_counts(top_10_products, "Top 10 Products", bar_color="#4340B1")),
+        columns=2,
+        widths=[6, 4],
+    )
+    return popular
+
+
+################################################################################
+# Cohort analysis
+@profiling.profiled("cohort_analysis")
+def gen_cohort_analysis(
+    snap: Snapshot, df_orders_window: pd.DataFrame, window_start: pd.Timestamp, window_end: pd.Timestamp, key: str
+) -> dp.Group:
+    if snap.db is not None:
+        df_calmap = snap.db.orders_per_day(window_start, window_end)
+    else:
+        # snapshot read straight from the CSVs, there's no database to query
+        df_calmap = (
+            (df_orders_window["Created at"].dt.date.value_counts().rename_axis("Date").to_frame("Orders"))
+            .reset_index()
+            .rename(columns={0: "counts"})
+        )
+
+    df, year, last_sample_date = calendar_heatmap.wrangle_df(df_calmap, year=2023)
+    cal_plot = calendar_heatmap.plot_heatmap("Orders", df, legend=True, color_scheme="cividis")
+
+    retention_fig, avg_order_fig = snap.results.cached(
+        "cohort_analysis",
+        key,
+        cohorts.cohort_analysis,
+        snap.cohort_store,
+        df_orders_window,
+        window_start,
+        window_end,
+    )
+
+    return dp.Group(cal_plot, dp.Group(dp.Plot(retention_fig), dp.Plot(avg_order_fig), columns=2))
+
+
+################################################################################
+# Customer segments
+# RFM segments and CLV are scored once per snapshot, a window just picks out its customers
+@profiling.profiled("customer_segments")
+def gen_customer_segments(snap: Snapshot, df_orders_window: pd.DataFrame) -> dp.Group:
+    customers = snap.segments.window(df_orders_window)
+    df_segments = segmentation.summary(customers)
+
+    customers_by_segment = df_segments["customers"].rename_axis("unique_values").to_frame("counts").reset_index()
+    clv_by_segment = df_segments["total_clv"].rename_axis("unique_values").to_frame("counts").reset_index()
+
+    champions = customers["segment"] == "Champions"
+    at_risk = customers["segment"].isin(["At Risk", "Can't Lose"])
+
+    segment_stats = dp.Group(
+        dp.BigNumber("Customers", f"{len(customers):n}"),
+        dp.BigNumber("Average CLV", locale.currency(customers["clv"].mean(), grouping=True)),
+        dp.BigNumber("Champions", f"{champions.sum():n}"),
+        dp.BigNumber("Champions CLV", locale.currency(customers.loc[champions, "clv"].sum(), grouping=True)),
+        dp.BigNumber("At Risk", f"{at_risk.sum():n}"),
+        dp.BigNumber("At Risk CLV", locale.currency(customers.loc[at_risk, "clv"].sum(), grouping=True)),
+        columns=3,
+    )
+
+    return dp.Group(
+        segment_stats,
+        dp.Group(
+            dp.Plot(a.plot_value_counts(customers_by_segment, "Customers by segment", bar_color="#5A5BC1")),
+            dp.Plot(a.plot_value_counts(clv_by_segment, "Total CLV by segment", bar_color="#E7088E")),
+            columns=2,
+        ),
+        dp.Table(df_segments.round(2)),
+    )
+
+
+################################################################################
+# Top Stats tab, also used for the scheduled reports
+def get_window_frames(
+    snap: Snapshot, window_start: pd.Timestamp, window_end: pd.Timestamp
+) -> t.Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    df_orders_window, df_orders_window_previous = a.get_window(snap.df_orders, "Created at", window_start, window_end)
+    df_items_window, df_items_window_previous = a.get_window(snap.df_items, "Created at", window_start, window_end)
+    df_customers_window, df_customers_window_previous = a.get_window(
+        snap.df_customers, "first_order", window_start, window_end
+    )
+    return (
+        df_orders_window,
+        df_orders_window_previous,
+        df_items_window,
+        df_items_window_previous,
+        df_customers_window,
+        df_customers_window_previous,
+    )
+
+
+def gen_top_stats(snap: Snapshot, window_start: pd.Timestamp, window_end: pd.Timestamp) -> dp.Group:
+    (
+        df_orders_window,
+        df_orders_window_previous,
+        df_items_window,
+        _,
+        df_customers_window,
+        df_customers_window_previous,
+    ) = get_window_frames(snap, window_start, window_end)
+
+    return dp.Group(
+        "## Summary",
+        gen_summary_stats(
+            snap,
+            df_orders_window,
+            df_customers_window,
+            df_orders_window_previous,
+            df_customers_window_previous,
+            window_start,
+            window_end,
+        ),
+        gen_top_products(snap, df_items_window, df_orders_window, df_customers_window),
+        label="Top Stats",
+    )
+
+
+@profiling.profiled("top_products")
+def gen_top_products(
+    snap: Snapshot, df_items_window: pd.DataFrame, df_orders_window: pd.DataFrame, df_customers_window: pd.DataFrame
+) -> dp.Group:
+    # the customer map is the slowest block in the tab, the app streams this in after the summary
+    return dp.Group(
+        *section("## Top Products"),
+        gen_top_product_stats(snap, df_items_window, df_orders_window, df_customers_window),
+        gen_audiencce_plots(df_orders_window),
+    )
+
+
+@profiling.profiled("order_data")
+def gen_order_data(df_orders_window: pd.DataFrame) -> dp.DataTable:
+    return dp.DataTable(df_orders_window)
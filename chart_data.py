@@ -0,0 +1,108 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+import typing as t
+from collections import OrderedDict
+
+import altair as alt
+import numpy as np
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+# Charts must be built from aggregated data, anything row-level is rejected outright
+MAX_ROWS = int(os.environ.get("CHART_MAX_ROWS", 5000))
+# Serialised size (bytes) of a single chart dataset before we warn
+PAYLOAD_BUDGET = int(os.environ.get("CHART_PAYLOAD_BUDGET", 100_000))
+# Decimal places kept for float columns
+PRECISION = 2
+
+# Shared datasets, keyed on content hash, so identical frames across charts are only encoded once
+_dataset_cache: "OrderedDict[str, t.Dict[str, t.Any]]" = OrderedDict()
+_dataset_cache_lock = threading.Lock()
+_DATASET_CACHE_SIZE = 64
+
+
+def compact_frame(df: pd.DataFrame, precision: int = PRECISION) -> pd.DataFrame:
+    """Round floats and narrow integral floats to ints so they serialise without trailing noise"""
+    df = df.copy()
+    for col in df.columns:
+        values = df[col]
+        if not pd.api.types.is_float_dtype(values):
+            continue
+        values = values.round(precision)
+        if values.notna().all() and np.array_equal(values, np.floor(values)):
+            values = values.astype(np.int64)
+        df[col] = values
+    return df
+
+
+def payload_size(values: t.Dict[str, t.Any]) -> int:
+    return len(json.dumps(values, separators=(",", ":"), default=str))
+
+
+def dataset_key(df: pd.DataFrame, precision: int = PRECISION) -> str:
+    """Content hash of a frame, row order, columns and dtypes included"""
+    h = hashlib.sha1(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    h.update(repr([(str(col), str(dtype)) for col, dtype in df.dtypes.items()]).encode())
+    h.update(str(precision).encode())
+    return h.hexdigest()
+
+
+def to_compact_values(
+    data: t.Any, max_rows: int = MAX_ROWS, budget: int = PAYLOAD_BUDGET, precision: int = PRECISION
+) -> t.Dict[str, t.Any]:
+    """Altair data transformer: row limit -> compaction -> dedupe -> inline values"""
+    if not isinstance(data, pd.DataFrame):
+        return alt.to_values(alt.limit_rows(data, max_rows=max_rows))
+
+    alt.limit_rows(data, max_rows=max_rows)
+
+    key = dataset_key(data, precision)
+    with _dataset_cache_lock:
+        if key in _dataset_cache:
+            _dataset_cache.move_to_end(key)
+            return _dataset_cache[key]
+
+    values = alt.to_values(compact_frame(data, precision))
+
+    size = payload_size(values)
+    if size > budget:
+        log.warning(f"Chart dataset is {size:,} bytes ({len(data)} rows), over the {budget:,} byte budget")
+
+    with _dataset_cache_lock:
+        _dataset_cache[key] = values
+        if len(_dataset_cache) > _DATASET_CACHE_SIZE:
+            _dataset_cache.popitem(last=False)
+    return values
+
+
+def enable() -> None:
+    alt.data_transformers.register("compact", to_compact_values)
+    alt.data_transformers.enable("compact")
+    # identical datasets within a spec are hoisted into the top-level `datasets` and referenced by name
+    alt.data_transformers.consolidate_datasets = True
+
+
+################################################################################
+# Server-side aggregations for chart inputs
+def nice_bins(series: pd.Series, maxbins: int = 10) -> np.ndarray:
+    """Bin edges on a 1/2/5 step, matching what Vega-Lite picks for `bin=True`"""
+    lo, hi = float(series.min()), float(series.max())
+    span = max(hi - lo, 1e-9)
+    step = 10 ** math.floor(math.log10(span / maxbins))
+    for mult in (1, 2, 5, 10):
+        if span / (step * mult) <= maxbins:
+            step *= mult
+            break
+    start = math.floor(lo / step) * step
+    stop = math.ceil(hi / step) * step
+    return np.arange(start, stop + step, step)
+
+
+def histogram_frame(series: pd.Series, bins: np.ndarray) -> pd.DataFrame:
+    counts, edges = np.histogram(series.dropna(), bins=bins)
+    return pd.DataFrame({"bin_min": edges[:-1], "bin_max": edges[1:], "count": counts})
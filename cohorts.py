@@ -0,0 +1,139 @@
+"""
+Incremental store of the monthly cohort cells.
+
+Each (cohort_month, cohort_index) cell covers the orders of a single calendar month, so once
+that month is over the cell never changes - the store keeps the cells for every closed month
+and `update` only computes the months that closed since the last refresh. The store holds the
+orders of the "All Data" window, so reading the cohorts for it is a lookup plus a recompute
+of the open month.
+"""
+import dataclasses as dc
+import pickle
+import typing as t
+from pathlib import Path
+
+import matplotlib
+import pandas as pd
+
+import analytics as a
+
+CELL_COLUMNS = ["customers", "total", "orders"]
+
+
+@dc.dataclass(frozen=True)
+class CohortStore:
+    # start of the "All Data" window (see `analytics.resolve_window`), the store holds the orders after it
+    start: t.Optional[pd.Timestamp]
+    # months before `closed` are complete, everything from it onwards is recomputed on read
+    closed: t.Optional[pd.Timestamp]
+    # cohort month of every customer with an order in a closed month
+    cohort_months: pd.Series
+    # closed cells, indexed by (cohort_month, cohort_index)
+    cells: pd.DataFrame
+    # orders per closed month, to spot data changing underneath the store
+    month_orders: pd.Series
+
+    @classmethod
+    def empty(cls) -> "CohortStore":
+        cells = pd.DataFrame(
+            columns=CELL_COLUMNS,
+            index=pd.MultiIndex.from_arrays(
+                [pd.DatetimeIndex([]), pd.Index([], dtype="int64")], names=["cohort_month", "cohort_index"]
+            ),
+        )
+        return cls(
+            start=None,
+            closed=None,
+            cohort_months=pd.Series(dtype="datetime64[ns]"),
+            cells=cells,
+            month_orders=pd.Series(dtype="int64"),
+        )
+
+    @classmethod
+    def build(cls, df_orders: pd.DataFrame) -> "CohortStore":
+        return cls.empty().update(df_orders)
+
+    @classmethod
+    def load(cls, path: Path) -> "CohortStore":
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def save(self, path: Path) -> None:
+        with open(path, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _closed_month_orders(self, order_month: pd.Series) -> pd.Series:
+        if self.closed is None:
+            return pd.Series(dtype="int64")
+        return order_month[order_month < self.closed].value_counts().sort_index()
+
+    def update(self, df_orders: pd.DataFrame) -> "CohortStore":
+        """A new store for `df_orders`, computing only the months that closed since this one was built"""
+        if df_orders.empty:
+            return self
+
+        start, _ = a.resolve_window(df_orders, None, None, all_data=True)
+        if self.start is not None and start != self.start:
+            # the history starts somewhere else now, so does every cohort
+            return CohortStore.build(df_orders)
+        df_history = df_orders[df_orders["Created at"] > start]
+        if df_history.empty:
+            return dc.replace(self, start=start)
+
+        order_month = a.order_months(df_history["Created at"])
+        if self.closed is not None and not self._closed_month_orders(order_month).equals(self.month_orders):
+            # orders were added to (or removed from) a closed month, start over
+            return CohortStore.build(df_orders)
+
+        # the latest month in the data is still open
+        closed = order_month.max() if self.closed is None else max(order_month.max(), self.closed)
+        closing = order_month < closed
+        if self.closed is not None:
+            closing &= order_month >= self.closed
+        if not closing.any():
+            return dc.replace(self, start=start, closed=closed)
+
+        df_closing = df_history[closing]
+        cells = a.cohort_cells(df_closing, self.cohort_months)
+
+        # customers first seen in the newly closed months start their cohort there
+        first_month = order_month[closing].groupby(df_closing["Cust_ID"]).min()
+        new_customers = first_month[~first_month.index.isin(self.cohort_months.index)]
+
+        return CohortStore(
+            start=start,
+            closed=closed,
+            cohort_months=_concat(self.cohort_months, new_customers),
+            cells=_concat(self.cells, cells),
+            month_orders=order_month[order_month < closed].value_counts().sort_index(),
+        )
+
+    def covers(self, window_start: pd.Timestamp, window_end: pd.Timestamp) -> bool:
+        """Whether the window starts where the store does and runs past its closed months, e.g. for All Data"""
+        if self.closed is None:
+            return False
+        # order months are in UTC, like the frames
+        return window_start == self.start and window_end >= self.closed.tz_localize("UTC")
+
+    def read(self, df_orders_window: pd.DataFrame) -> pd.DataFrame:
+        """Cohort cells for a window the store `covers`, the closed cells plus the recomputed open month"""
+        df_open = df_orders_window[a.order_months(df_orders_window["Created at"]) >= self.closed]
+        if df_open.empty:
+            return self.cells
+        return _concat(self.cells, a.cohort_cells(df_open, self.cohort_months))
+
+
+def _concat(old: t.Any, new: t.Any) -> t.Any:
+    return new.sort_index() if old.empty else pd.concat([old, new]).sort_index()
+
+
+def cohort_analysis(
+    store: CohortStore,
+    df_orders_window: pd.DataFrame,
+    window_start: pd.Timestamp,
+    window_end: pd.Timestamp,
+) -> t.Tuple[matplotlib.figure.Figure, matplotlib.figure.Figure]:
+    """`analytics.cohort_analysis`, reading the closed months from the store when the window spans them"""
+    if store.covers(window_start, window_end):
+        return a.plot_cohorts(*a.cohort_matrices(store.read(df_orders_window)))
+    return a.cohort_analysis(df_orders_window)
@@ -0,0 +1,44 @@
+import hashlib
+import typing as t
+from pathlib import Path
+
+import pandas as pd
+
+import analytics as a
+from zipcodes import ZipcodeLookup
+
+DATA_DIR = Path("data")
+ORDERS_FILE = "order.csv.gz"
+ITEMS_FILE = "items.csv.gz"
+CUSTOMERS_FILE = "cust.csv.gz"
+ZIPCODE_LOOKUP_FILE = "zipcode_lookup.json"
+# prebuilt columnar form of the above, see `zipcodes`
+ZIPCODE_LOOKUP_DIR = "zipcode_lookup"
+
+Dataset = t.Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, ZipcodeLookup]
+
+
+def version(data_dir: Path = DATA_DIR) -> str:
+    """Cheap fingerprint of the source files, changes whenever any of them is rewritten"""
+    h = hashlib.sha1()
+    for fname in (ORDERS_FILE, ITEMS_FILE, CUSTOMERS_FILE, ZIPCODE_LOOKUP_FILE):
+        stat = (data_dir / fname).stat()
+        h.update(f"{fname}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return h.hexdigest()[:12]
+
+
+def load(data_dir: Path = DATA_DIR) -> Dataset:
+    df_orders = pd.read_csv(data_dir / ORDERS_FILE).set_index("Name")
+    df_items = pd.read_csv(data_dir / ITEMS_FILE, low_memory=False).set_index("Name")
+    df_customers = pd.read_csv(data_dir / CUSTOMERS_FILE).set_index("Cust_ID")
+    if (data_dir / ZIPCODE_LOOKUP_DIR).exists():
+        zipcode_lookup = ZipcodeLookup.load(data_dir / ZIPCODE_LOOKUP_DIR)
+    else:
+        zipcode_lookup = ZipcodeLookup.from_json(data_dir / ZIPCODE_LOOKUP_FILE)
+
+    # make our `datetime`s aware of the time zone.
+    a.set_timezones(df_orders, ["Created at"])
+    a.set_timezones(df_items, ["Created at"])
+    a.set_timezones(df_customers, ["first_order", "last_order"])
+
+    return df_orders, df_items, df_customers, zipcode_lookup
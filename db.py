@@ -0,0 +1,132 @@
+"""
+Read access to a snapshot's DuckDB database for the app.
+
+Each snapshot gets one read-only database handle (so readers never contend with `update-db`,
+which only ever writes into a new snapshot), shared by every thread through its own cursor.
+Queries are parameterised so DuckDB prepares them once per cursor instead of per window.
+"""
+import contextlib
+import os
+import threading
+import typing as t
+from pathlib import Path
+
+import duckdb
+import pandas as pd
+
+THREADS = int(os.environ.get("DUCKDB_THREADS", 4))
+MEMORY_LIMIT = os.environ.get("DUCKDB_MEMORY_LIMIT", "1GB")
+
+################################################################################
+# Queries
+# windows are open at both ends, as in `analytics.get_window`. Days are bucketed through a (UTC)
+# TIMESTAMP, DuckDB 0.7 can't cast TIMESTAMP WITH TIME ZONE to DATE
+ORDERS_PER_DAY = """
+    SELECT CAST(CAST("Created at" AS TIMESTAMP) AS DATE) AS "Date", count(*) AS "Orders"
+    FROM orders
+    WHERE "Created at" > $window_start AND "Created at" < $window_end
+    GROUP BY 1
+    ORDER BY 1
+"""
+# `analytics.summary_stats` for a window and the one before it (as `analytics.get_window` returns),
+# orders without a Cust_ID count as one more customer, like `unique` does
+SUMMARY_STATS = """
+    WITH windows AS (
+        SELECT * FROM (VALUES ('current', $window_start, $window_end), ('previous', $previous_start, $window_start))
+            AS w(period, window_start, window_end)
+    ),
+    orders_stats AS (
+        SELECT
+            period,
+            count(o."Created at") AS orders,
+            count(o."Created at") FILTER (WHERE o."Financial Status" = 'paid') AS sales,
+            avg(o."Total") AS aov,
+            coalesce(sum(o."Total"), 0) AS revenue,
+            count(DISTINCT o."Cust_ID") + (count(o."Created at") > count(o."Cust_ID"))::INTEGER AS distinct_customers
+        FROM windows
+        LEFT JOIN orders o ON o."Created at" > windows.window_start AND o."Created at" < windows.window_end
+        GROUP BY period
+    ),
+    customers_stats AS (
+        SELECT period, count(c.first_order) AS new_customers
+        FROM windows
+        LEFT JOIN customers c ON c.first_order > windows.window_start AND c.first_order < windows.window_end
+        GROUP BY period
+    )
+    SELECT
+        period,
+        orders,
+        sales,
+        aov,
+        revenue,
+        new_customers,
+        distinct_customers - new_customers AS returning_customers
+    FROM orders_stats JOIN customers_stats USING (period)
+"""
+
+
+def connect(db_file: Path, read_only: bool = True) -> duckdb.DuckDBPyConnection:
+    config = {"threads": THREADS, "memory_limit": MEMORY_LIMIT}
+    return _utc(duckdb.connect(str(db_file), read_only=read_only, config=config))
+
+
+def _utc(con: duckdb.DuckDBPyConnection) -> duckdb.DuckDBPyConnection:
+    # bucket days in UTC like the frames do, without ICU DuckDB already treats time zones as UTC
+    with contextlib.suppress(duckdb.Error):
+        con.execute("SET TimeZone = 'UTC'")
+    return con
+
+
+def _bind(value: t.Any) -> t.Any:
+    # DuckDB 0.7 binds a tz-aware timestamp as its local wall-clock time, so pass them as naive UTC
+    if isinstance(value, pd.Timestamp) and value.tz is not None:
+        return value.tz_convert("UTC").tz_localize(None)
+    return value
+
+
+class ConnectionPool:
+    """A read-only connection to one database file, handing out a cursor per thread"""
+
+    def __init__(self, db_file: Path):
+        self.db_file = db_file
+        self._con = connect(db_file)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._cursors: t.List[duckdb.DuckDBPyConnection] = []
+
+    def cursor(self) -> duckdb.DuckDBPyConnection:
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is None:
+            # creating cursors isn't thread-safe, using them (one per thread) is
+            with self._lock:
+                cursor = self._local.cursor = _utc(self._con.cursor())
+                self._cursors.append(cursor)
+        return cursor
+
+    def query(self, sql: str, **params: t.Any) -> pd.DataFrame:
+        return self.cursor().execute(sql, {name: _bind(value) for name, value in params.items()}).df()
+
+    def close(self) -> None:
+        with self._lock:
+            for cursor in self._cursors:
+                cursor.close()
+            self._cursors.clear()
+            self._con.close()
+
+    ############################################################################
+    # Window queries
+    def orders_per_day(self, window_start: pd.Timestamp, window_end: pd.Timestamp) -> pd.DataFrame:
+        df = self.query(ORDERS_PER_DAY, window_start=window_start, window_end=window_end)
+        df["Date"] = df["Date"].dt.date
+        return df
+
+    def summary_stats(
+        self, window_start: pd.Timestamp, window_end: pd.Timestamp
+    ) -> t.Tuple[pd.DataFrame, pd.DataFrame]:
+        """Summary stats of the window and the previous one, as `analytics.summary_stats`"""
+        previous_start = window_start - (window_end - window_start)
+        df = self.query(
+            SUMMARY_STATS, window_start=window_start, window_end=window_end, previous_start=previous_start
+        ).set_index("period")
+        df = df.astype(float)
+        return df.loc[["current"]].reset_index(drop=True), df.loc[["previous"]].reset_index(drop=True)
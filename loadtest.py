@@ -0,0 +1,282 @@
+"""
+Load test the marketing app's form with a realistic mix of windows.
+
+    python loadtest.py --concurrency 8 --requests 200              # call `views.render` in-process
+    python loadtest.py --serve --concurrency 8 --requests 200      # start app.py and drive it over HTTP
+    python loadtest.py --url http://127.0.0.1:8080 --pid 1234      # drive an already running server
+
+In-process, each request calls `views.render` (the app's form handler) with a session of its own, the
+same as each form submit does. Over HTTP each request is a new browser session against `dp.serve_app`.
+Reports p50/p95/p99 latency both to the first view (summary tab) and until every
+deferred tab has been delivered, throughput, and the app process's RSS over time.
+"""
+import argparse
+import concurrent.futures as cf
+import contextlib
+import dataclasses as dc
+import datetime
+import http.cookiejar
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import typing as t
+import urllib.request
+from pathlib import Path
+
+import numpy as np
+
+import profiling
+import snapshots
+
+# (weight, window) - mostly the standard windows, with some arbitrary ranges and "All Data"
+WINDOW_MIX = [
+    (0.3, "last_7_days"),
+    (0.2, "last_30_days"),
+    (0.2, "default"),
+    (0.2, "random"),
+    (0.1, "all_data"),
+]
+
+# the app functions in a view, and how the browser calls them - on submit, or as soon as they're mounted
+COMPUTE_RE = re.compile(r'<Compute function_id="(app\.[\w.]+)"[^>]*? trigger="(\w+)"')
+
+
+@dc.dataclass
+class Sample:
+    started: float
+    first_view: float
+    complete: float
+    window: str
+    error: t.Optional[str] = None
+
+
+def gen_window(kind: str, anchor: datetime.date, rng: random.Random) -> t.Tuple[datetime.date, datetime.date, bool]:
+    if kind == "last_7_days":
+        return anchor - datetime.timedelta(days=7), anchor, False
+    elif kind == "last_30_days":
+        return anchor - datetime.timedelta(days=30), anchor, False
+    elif kind == "default":
+        return anchor - datetime.timedelta(weeks=26), anchor, False
+    elif kind == "random":
+        end = anchor - datetime.timedelta(days=rng.randint(0, 365))
+        return end - datetime.timedelta(days=rng.randint(7, 180)), end, False
+    else:
+        return anchor, anchor, True
+
+
+def rss_bytes(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+################################################################################
+# Clients
+class InProcessClient:
+    """Calls `views.render` directly, waiting on the deferred tabs for completion"""
+
+    def __init__(self, profile: bool = False):
+        import views
+
+        self.views = views
+        self.profile = profile
+
+    def __call__(self, start_date: datetime.date, end_date: datetime.date, all_data: bool) -> t.Tuple[float, float]:
+        session: t.Dict[str, t.Any] = {}
+        t0 = time.perf_counter()
+        with profiling.profile_request(source="loadtest") if self.profile else contextlib.nullcontext():
+            self.views.render(start_date, end_date, all_data, session)
+        first_view = time.perf_counter() - t0
+        cf.wait(session["pending"].futures)
+        return first_view, time.perf_counter() - t0
+
+
+class HttpClient:
+    """Drives the app's JSON-RPC endpoint the way the browser does, one session per call"""
+
+    def __init__(self, url: str, timeout: float):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def rpc(self, opener: urllib.request.OpenerDirector, method: str, params: t.Dict[str, t.Any]) -> str:
+        body = json.dumps({"jsonrpc": "2.0", "id": 1, "method": method, "params": params}).encode()
+        req = urllib.request.Request(
+            f"{self.url}/app-rpc-call/", data=body, headers={"Content-Type": "application/json"}
+        )
+        with opener.open(req, timeout=self.timeout) as res:
+            payload = json.load(res)
+        if "error" in payload:
+            raise RuntimeError(payload["error"]["message"])
+        return payload["result"]["view_xml"]
+
+    def load(self, opener: urllib.request.OpenerDirector, view_xml: str) -> t.List[str]:
+        """Call the functions mounted by a view concurrently, like the browser, returning their views"""
+        mounted = [f_id for f_id, trigger in COMPUTE_RE.findall(view_xml) if trigger == "mount"]
+        with cf.ThreadPoolExecutor(max_workers=max(len(mounted), 1)) as pool:
+            return list(pool.map(lambda f_id: self.rpc(opener, f_id, {}), mounted))
+
+    def __call__(self, start_date: datetime.date, end_date: datetime.date, all_data: bool) -> t.Tuple[float, float]:
+        # the page sets the session cookie, the main view then loads the form and registers it for the session
+        opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        opener.open(f"{self.url}/", timeout=self.timeout).close()
+        form_view = "".join(self.load(opener, self.rpc(opener, "app.main", {})))
+        (form_id,) = [f_id for f_id, trigger in COMPUTE_RE.findall(form_view) if trigger == "submit"]
+
+        params = {"start_date": start_date.isoformat(), "end_date": end_date.isoformat(), "all_data": all_data}
+        t0 = time.perf_counter()
+        view_xml = self.rpc(opener, form_id, params)
+        first_view = time.perf_counter() - t0
+
+        # then the deferred tabs
+        self.load(opener, view_xml)
+        return first_view, time.perf_counter() - t0
+
+
+def start_server(port: int) -> subprocess.Popen:
+    # `dp.serve_app` listens on $PORT when it's set
+    proc = subprocess.Popen(
+        [sys.executable, "app.py"],
+        cwd=Path(__file__).parent,
+        env={**os.environ, "PORT": str(port)},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"app.py exited with {proc.returncode}")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1).close()
+            return proc
+        except OSError:
+            time.sleep(0.5)
+    proc.terminate()
+    raise TimeoutError("app.py didn't start serving in time")
+
+
+################################################################################
+# Runner
+def run(
+    client: t.Callable[[datetime.date, datetime.date, bool], t.Tuple[float, float]],
+    *,
+    requests: int,
+    concurrency: int,
+    anchor: datetime.date,
+    seed: int,
+    pid: t.Optional[int],
+    rss_interval: float,
+) -> t.Tuple[t.List[Sample], t.List[t.Tuple[float, int]], float]:
+    rng = random.Random(seed)
+    weights, kinds = zip(*WINDOW_MIX)
+    windows = [(kind, gen_window(kind, anchor, rng)) for kind in rng.choices(kinds, weights, k=requests)]
+
+    rss: t.List[t.Tuple[float, int]] = []
+    done = threading.Event()
+    t_start = time.perf_counter()
+
+    def sample_rss() -> None:
+        while not done.is_set():
+            rss.append((time.perf_counter() - t_start, rss_bytes(pid)))
+            done.wait(rss_interval)
+
+    def one(window: t.Tuple[str, t.Tuple[datetime.date, datetime.date, bool]]) -> Sample:
+        kind, params = window
+        started = time.perf_counter() - t_start
+        try:
+            first_view, complete = client(*params)
+            return Sample(started, first_view, complete, kind)
+        except Exception as e:
+            return Sample(started, np.nan, np.nan, kind, error=f"{type(e).__name__}: {e}")
+
+    if pid is not None:
+        threading.Thread(target=sample_rss, daemon=True).start()
+    with cf.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(one, windows))
+    elapsed = time.perf_counter() - t_start
+    done.set()
+    return samples, rss, elapsed
+
+
+def report(samples: t.List[Sample], rss: t.List[t.Tuple[float, int]], elapsed: float, concurrency: int) -> str:
+    ok = [s for s in samples if s.error is None]
+    lines = [
+        f"requests: {len(samples)} ({len(samples) - len(ok)} errors) at concurrency {concurrency}",
+        f"elapsed: {elapsed:.2f}s, throughput: {len(ok) / elapsed:.2f} req/s",
+    ]
+    for label, values in (("first view", [s.first_view for s in ok]), ("complete", [s.complete for s in ok])):
+        if values:
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            lines.append(f"{label:>10}: p50 {p50 * 1000:.0f}ms  p95 {p95 * 1000:.0f}ms  p99 {p99 * 1000:.0f}ms")
+
+    for kind in sorted({s.window for s in ok}):
+        values = [s.complete for s in ok if s.window == kind]
+        lines.append(f"  {kind:<14} n={len(values):<4} p50 {np.percentile(values, 50) * 1000:.0f}ms")
+
+    if rss:
+        peak = max(r for _, r in rss)
+        start, end = rss[0][1], rss[-1][1]
+        lines.append(f"rss: start {start / 2**20:.0f}MiB, peak {peak / 2**20:.0f}MiB, end {end / 2**20:.0f}MiB")
+    for error in sorted({s.error for s in samples if s.error})[:5]:
+        lines.append(f"error: {error}")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Concurrent load test of the marketing app form")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--serve", action="store_true", help="start app.py locally and drive it over HTTP")
+    target.add_argument("--url", help="drive an already running app at this URL")
+    parser.add_argument("--pid", type=int, help="pid of the server given by --url, for RSS sampling")
+    parser.add_argument("--port", type=int, default=8089, help="port for --serve")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=300, help="per call timeout over HTTP (s)")
+    parser.add_argument("--rss-interval", type=float, default=0.5, help="seconds between RSS samples")
+    parser.add_argument("--rss-csv", type=Path, help="write the RSS samples here")
+    parser.add_argument("--profile", action="store_true", help="profile every in-process render (needs PROFILE=1)")
+    args = parser.parse_args()
+
+    # anchor the windows on the latest order so they actually contain data
+    anchor = snapshots.current().df_orders["Created at"].max().date()
+
+    server = None
+    if args.serve:
+        server = start_server(args.port)
+        client, pid = HttpClient(f"http://127.0.0.1:{args.port}", args.timeout), server.pid
+    elif args.url:
+        client, pid = HttpClient(args.url, args.timeout), args.pid
+    else:
+        client, pid = InProcessClient(profile=args.profile), os.getpid()
+
+    try:
+        samples, rss, elapsed = run(
+            client,
+            requests=args.requests,
+            concurrency=args.concurrency,
+            anchor=anchor,
+            seed=args.seed,
+            pid=pid,
+            rss_interval=args.rss_interval,
+        )
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print(report(samples, rss, elapsed, args.concurrency))
+    if isinstance(client, InProcessClient):
+        print(f"render coalescing: {client.views.render_flights.stats()}")
+    if args.rss_csv:
+        args.rss_csv.write_text("seconds,rss_bytes\n" + "".join(f"{ts:.3f},{r}\n" for ts, r in rss))
+
+
+if __name__ == "__main__":
+    main()
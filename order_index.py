@@ -0,0 +1,65 @@
+import dataclasses as dc
+import typing as t
+
+import numpy as np
+import pandas as pd
+
+
+@dc.dataclass
+class OrderIndex:
+    """
+    CSR index from order `Name` to the distinct products in that order, built once at load time.
+
+    The products of the order at position `i` are `products[codes[offsets[i]:offsets[i + 1]]]`,
+    with `names` sorted so lookups are a binary search rather than a fresh `groupby("Name")`.
+    """
+
+    names: np.ndarray
+    offsets: np.ndarray
+    codes: np.ndarray
+    products: pd.Index
+
+    @classmethod
+    def build(cls, df_items: pd.DataFrame, product_col: str = "Lineitem name") -> "OrderIndex":
+        df_items = df_items[df_items[product_col].notna()]
+        order_codes, names = pd.factorize(df_items.index, sort=True)
+        product_codes, products = pd.factorize(df_items[product_col], sort=True)
+
+        # sort by (order, product) and drop repeated products within an order
+        perm = np.lexsort((product_codes, order_codes))
+        order_codes, product_codes = order_codes[perm], product_codes[perm]
+        distinct = np.ones(len(perm), dtype=bool)
+        distinct[1:] = (order_codes[1:] != order_codes[:-1]) | (product_codes[1:] != product_codes[:-1])
+        order_codes, product_codes = order_codes[distinct], product_codes[distinct]
+
+        offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(order_codes, minlength=len(names)), out=offsets[1:])
+        return cls(np.asarray(names, dtype=object), offsets, product_codes.astype(np.int32), pd.Index(products))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def positions(self, names: t.Iterable[str]) -> np.ndarray:
+        """Sorted positions of the given order names, orders without line items are dropped"""
+        names = np.asarray(pd.unique(pd.Index(names)), dtype=object)
+        pos = np.searchsorted(self.names, names)
+        pos = np.minimum(pos, len(self.names) - 1)
+        return np.sort(pos[self.names[pos] == names])
+
+    def basket_sizes(self, pos: t.Optional[np.ndarray] = None) -> np.ndarray:
+        """Number of distinct products per order"""
+        sizes = np.diff(self.offsets)
+        return sizes if pos is None else sizes[pos]
+
+    def one_hot(self, pos: np.ndarray) -> pd.DataFrame:
+        """Boolean order x product matrix for the given orders, limited to the products they contain"""
+        sizes = self.basket_sizes(pos)
+        rows = np.repeat(np.arange(len(pos)), sizes)
+        # flat positions into `codes` for every (order, product) pair
+        starts = np.repeat(self.offsets[pos] - np.cumsum(sizes) + sizes, sizes)
+        cols = self.codes[starts + np.arange(sizes.sum())]
+
+        used, cols = np.unique(cols, return_inverse=True)
+        matrix = np.zeros((len(pos), len(used)), dtype=bool)
+        matrix[rows, cols] = True
+        return pd.DataFrame(matrix, index=pd.Index(self.names[pos], name="Name"), columns=self.products[used])
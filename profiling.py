@@ -0,0 +1,189 @@
+"""
+On-demand profiling of `render` and the scheduled tasks.
+
+Off by default, in which case `profiled` returns the function untouched. With PROFILE=1 a call is
+profiled when it's inside `profile_request()`, or at random with probability PROFILE_SAMPLE_RATE.
+Work a profiled call hands to `submit` inherits the decision and the request parameters.
+
+To profile one window that's slow in production, set PROFILE_WINDOWS to its key (comma separated
+for several, see `results_cache.window_key`, e.g. `20221027T000000-0700_20230427T000000-0700`) -
+every render of it is then profiled by the app, PROFILE=1 isn't needed.
+
+Each profiled call writes `<name>-<request id>-<thread id>` files to PROFILE_DIR:
+- `.collapsed` - sampled stacks in folded format (flamegraph.pl, speedscope, inferno), or
+  `.prof` - a deterministic cProfile dump (snakeviz, flameprof) with PROFILE_MODE=deterministic
+- `.json` - the request parameters and timing
+"""
+import collections
+import concurrent.futures as cf
+import contextlib
+import contextvars
+import cProfile
+import datetime
+import functools
+import inspect
+import json
+import os
+import random
+import sys
+import threading
+import time
+import typing as t
+import uuid
+from pathlib import Path
+
+# window keys whose renders are always profiled
+WINDOWS = frozenset(key.strip() for key in os.environ.get("PROFILE_WINDOWS", "").split(",") if key.strip())
+ENABLED = os.environ.get("PROFILE", "0") == "1" or bool(WINDOWS)
+SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+MODE = os.environ.get("PROFILE_MODE", "sampling")
+INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.005))
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR", "profiles"))
+
+F = t.TypeVar("F", bound=t.Callable[..., t.Any])
+
+# set for the duration of a profiled request, and inherited by work submitted on its behalf
+_request: "contextvars.ContextVar[t.Optional[t.Dict[str, t.Any]]]" = contextvars.ContextVar(
+    "profile_request", default=None
+)
+
+
+@contextlib.contextmanager
+def profile_request(**params: t.Any) -> t.Iterator[None]:
+    """Profile every `profiled` call made within this block"""
+    token = _request.set({"id": uuid.uuid4().hex[:8], **params})
+    try:
+        yield
+    finally:
+        _request.reset(token)
+
+
+def profile_window(key: str) -> t.ContextManager[None]:
+    """`profile_request` for a window listed in PROFILE_WINDOWS, unless already inside one"""
+    if key not in WINDOWS or _request.get() is not None:
+        return contextlib.nullcontext()
+    return profile_request(window=key, source="PROFILE_WINDOWS")
+
+
+def submit(pool: cf.Executor, f: t.Callable[..., t.Any], *args: t.Any) -> cf.Future:
+    """`pool.submit` that carries the profiling context over to the worker thread"""
+    return pool.submit(contextvars.copy_context().run, f, *args)
+
+
+def profiled(name: str) -> t.Callable[[F], F]:
+    def decorator(f: F) -> F:
+        if not ENABLED:
+            return f
+
+        sig = inspect.signature(f)
+
+        @functools.wraps(f)
+        def wrapper(*args: t.Any, **kwargs: t.Any) -> t.Any:
+            request = _request.get()
+            if request is None and not (SAMPLE_RATE and random.random() < SAMPLE_RATE):
+                return f(*args, **kwargs)
+
+            if request is None:
+                request = {"id": uuid.uuid4().hex[:8]}
+            params = {**request, **_describe_args(sig, args, kwargs)}
+
+            # nested and submitted calls see this call's parameters too
+            token = _request.set(params)
+            try:
+                with _profile(name, params):
+                    return f(*args, **kwargs)
+            finally:
+                _request.reset(token)
+
+        return t.cast(F, wrapper)
+
+    return decorator
+
+
+def _describe_args(sig: inspect.Signature, args: t.Tuple, kwargs: t.Dict) -> t.Dict[str, t.Any]:
+    # keep the simple parameters (dates, flags, keys) and skip frames, snapshots, sessions, etc.
+    bound = sig.bind_partial(*args, **kwargs)
+    simple = (str, int, float, bool, datetime.date, type(None))
+    return {k: str(v) for k, v in bound.arguments.items() if isinstance(v, simple)}
+
+
+################################################################################
+# Profilers
+# whether a profiler is already running on this thread
+_active = threading.local()
+
+
+@contextlib.contextmanager
+def _profile(name: str, params: t.Dict[str, t.Any]) -> t.Iterator[None]:
+    if getattr(_active, "profiling", False):
+        # nested in a profiled call, which already captures this one (and only one cProfile can be enabled)
+        yield
+        return
+
+    _active.profiling = True
+    try:
+        with _run_profiler(name, params):
+            yield
+    finally:
+        _active.profiling = False
+
+
+@contextlib.contextmanager
+def _run_profiler(name: str, params: t.Dict[str, t.Any]) -> t.Iterator[None]:
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    stem = PROFILE_DIR / f"{name}-{params['id']}-{threading.get_ident()}"
+    started = time.time()
+    t0 = time.perf_counter()
+
+    if MODE == "deterministic":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(f"{stem}.prof")
+    else:
+        sampler = _StackSampler(threading.get_ident(), INTERVAL)
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            sampler.write(Path(f"{stem}.collapsed"))
+
+    meta = {"name": name, "mode": MODE, "started": started, "duration": time.perf_counter() - t0, "params": params}
+    Path(f"{stem}.json").write_text(json.dumps(meta, indent=2))
+
+
+class _StackSampler(threading.Thread):
+    """Periodically captures the target thread's stack, counting identical stacks"""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: t.Counter[str] = collections.Counter()
+        self._done = threading.Event()
+
+    def run(self) -> None:
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[_fold(frame)] += 1
+
+    def stop(self) -> None:
+        self._done.set()
+        self.join()
+
+    def write(self, path: Path) -> None:
+        path.write_text("".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common()))
+
+
+def _fold(frame: t.Any) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
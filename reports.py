@@ -0,0 +1,189 @@
+"""
+Batch generation of the scheduled reports.
+
+Takes a list of windows, optionally narrowed to one customer segment, and renders a standalone
+report for each. The snapshot (and the per-segment slices of it) is loaded once in this process
+and the workers are forked from it, so they share it copy-on-write instead of each reloading it.
+The forked workers don't use the snapshot's database, DuckDB handles don't survive a fork.
+The whole batch is bounded by REPORT_TIMEOUT - anything still rendering then is reported as
+timed out and its worker killed. The reports are sent as one compressed archive, with a summary
+of the reports that failed, timed out or were skipped for having no orders.
+"""
+import dataclasses as dc
+import datetime
+import logging
+import multiprocessing as mp
+import os
+import re
+import time
+import typing as t
+import zipfile
+from pathlib import Path
+
+import datapane as dp
+
+import analytics as a
+import blocks
+import snapshots
+from snapshots import Snapshot
+
+log = logging.getLogger(__name__)
+
+REPORT_DIR = Path(os.environ.get("REPORT_DIR", "reports"))
+WORKERS = int(os.environ.get("REPORT_WORKERS", os.cpu_count() or 1))
+TIMEOUT = float(os.environ.get("REPORT_TIMEOUT", 600))
+COMPRESS_LEVEL = 6
+
+
+@dc.dataclass(frozen=True)
+class ReportSpec:
+    name: str
+    start_date: datetime.date
+    end_date: datetime.date
+    all_data: bool = False
+    # one of `segmentation.SEGMENT_NAMES`, or everyone
+    segment: t.Optional[str] = None
+
+
+@dc.dataclass
+class ReportResult:
+    spec: ReportSpec
+    file: t.Optional[Path]
+    seconds: float
+    error: t.Optional[str] = None
+
+
+def slugify(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+
+
+def segment_snapshot(snap: Snapshot, segment: str) -> Snapshot:
+    """The snapshot narrowed down to the customers in one segment, and their orders"""
+    customers = snap.segments.customers
+    cust_ids = customers.index[customers["segment"] == segment]
+    df_orders = snap.df_orders[snap.df_orders["Cust_ID"].isin(cust_ids)]
+
+    return dc.replace(
+        snap,
+        # nested under the snapshot's version, so its cached results are removed along with the snapshot's
+        version=f"{snap.version}/{slugify(segment)}",
+        df_orders=df_orders,
+        df_items=snap.df_items[snap.df_items.index.isin(df_orders.index)],
+        df_customers=snap.df_customers[snap.df_customers.index.isin(cust_ids)],
+        db=None,
+        stored_cohorts=None,
+    )
+
+
+def segment_snapshots(snap: Snapshot, segments: t.Iterable[str]) -> t.Dict[t.Optional[str], Snapshot]:
+    """The snapshot keyed by `None`, and its slice for each of the segments"""
+    snaps: t.Dict[t.Optional[str], Snapshot] = {None: snap}
+    for segment in segments:
+        snaps[segment] = segment_snapshot(snap, segment)
+    return snaps
+
+
+################################################################################
+# Rendering
+def has_orders(snap: Snapshot, spec: ReportSpec) -> bool:
+    """Whether there are any orders in the spec's window, `snap` already narrowed to its segment"""
+    if snap.df_orders.empty:
+        return False
+    window_start, window_end = a.resolve_window(snap.df_orders, spec.start_date, spec.end_date, spec.all_data)
+    df_orders_window, _ = a.get_window(snap.df_orders, "Created at", window_start, window_end)
+    return not df_orders_window.empty
+
+
+def render_report(snap: Snapshot, spec: ReportSpec, out_dir: Path) -> Path:
+    who = spec.segment or "All customers"
+    if not has_orders(snap, spec):
+        # nothing to chart, e.g. a dormant segment over the last few weeks
+        report = dp.Group(f"## {who}", "_No orders in this window._")
+    else:
+        window_start, window_end = a.resolve_window(snap.df_orders, spec.start_date, spec.end_date, spec.all_data)
+        title = f"{who}: {window_start:%Y-%m-%d} to {window_end:%Y-%m-%d}"
+        report = dp.Group(f"## {title}", blocks.gen_top_stats(snap, window_start, window_end))
+
+    html_file = out_dir / f"{spec.name}.html"
+    dp.save_report(report, str(html_file), name=spec.name)
+    return html_file
+
+
+# set in each worker (inherited when forked), keyed by segment with `None` for the full snapshot
+_snapshots: t.Dict[t.Optional[str], Snapshot] = {}
+
+
+def _init_worker(snaps: t.Dict[t.Optional[str], Snapshot]) -> None:
+    global _snapshots
+    _snapshots = snaps
+
+
+def _render(spec: ReportSpec, out_dir: Path) -> ReportResult:
+    t0 = time.perf_counter()
+    try:
+        file = render_report(_snapshots[spec.segment], spec, out_dir)
+        return ReportResult(spec, file, time.perf_counter() - t0)
+    except Exception as e:
+        log.exception(f"Failed to render report {spec.name}")
+        return ReportResult(spec, None, time.perf_counter() - t0, error=f"{type(e).__name__}: {e}")
+
+
+def generate(
+    specs: t.Sequence[ReportSpec],
+    snap: t.Optional[Snapshot] = None,
+    out_dir: Path = REPORT_DIR,
+    workers: int = WORKERS,
+    timeout: float = TIMEOUT,
+    snaps: t.Optional[t.Dict[t.Optional[str], Snapshot]] = None,
+) -> t.List[ReportResult]:
+    """
+    Render every report from the one snapshot, in parallel where we can fork, returning results in `specs` order.
+    `snaps` are the `segment_snapshots` the specs need, if the caller already has them.
+    """
+    if snaps is None:
+        snap = snapshots.current() if snap is None else snap
+        snaps = segment_snapshots(snap, {spec.segment for spec in specs if spec.segment is not None})
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    if workers <= 1 or len(specs) <= 1 or "fork" not in mp.get_all_start_methods():
+        _init_worker(snaps)
+        return [_render(spec, out_dir) for spec in specs]
+
+    # DuckDB isn't fork-safe, so the workers compute from the frames rather than the parent's database handle
+    snaps = {segment: dc.replace(segment_snap, db=None) for segment, segment_snap in snaps.items()}
+    deadline = time.monotonic() + timeout
+    # forked rather than spawned, so the workers share the snapshots instead of pickling them across
+    with mp.get_context("fork").Pool(min(workers, len(specs)), initializer=_init_worker, initargs=(snaps,)) as pool:
+        pending = [(spec, pool.apply_async(_render, (spec, out_dir))) for spec in specs]
+        results = []
+        for spec, result in pending:
+            try:
+                results.append(result.get(max(deadline - time.monotonic(), 0)))
+            except mp.TimeoutError:
+                log.warning(f"Report {spec.name} didn't finish within {timeout}s")
+                results.append(ReportResult(spec, None, timeout, error="timed out"))
+    # leaving the pool terminates any workers still rendering
+    return results
+
+
+################################################################################
+# Sending
+def summarise(results: t.Sequence[ReportResult], skipped: t.Sequence[ReportSpec] = ()) -> str:
+    failed = [result for result in results if result.file is None]
+    lines = [f"{len(results) - len(failed)} of {len(results)} reports rendered"]
+    lines += [f"- {result.spec.name}: {result.error}" for result in failed]
+    lines += [f"- {spec.name}: skipped, no orders in the window" for spec in skipped]
+    return "\n".join(lines)
+
+
+def bundle(
+    results: t.Sequence[ReportResult], name: str, skipped: t.Sequence[ReportSpec] = (), out_dir: Path = REPORT_DIR
+) -> Path:
+    """One compressed archive of the rendered reports plus the summary, to send the whole batch at once"""
+    zip_file = out_dir / f"{name}.zip"
+    with zipfile.ZipFile(zip_file, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=COMPRESS_LEVEL) as zf:
+        zf.writestr("summary.txt", summarise(results, skipped) + "\n")
+        for result in results:
+            if result.file is not None:
+                zf.write(result.file, arcname=result.file.name)
+    return zip_file
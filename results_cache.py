@@ -0,0 +1,72 @@
+import datetime
+import os
+import pickle
+import tempfile
+import threading
+import typing as t
+from collections import OrderedDict
+from pathlib import Path
+
+from singleflight import SingleFlight
+
+CACHE_DIR = Path(os.environ.get("RESULTS_CACHE_DIR", "data/cache"))
+
+
+# ad-hoc windows are only kept in memory, this many results per snapshot
+MEMORY_ENTRIES = int(os.environ.get("RESULTS_CACHE_ENTRIES", 32))
+
+
+def window_key(window_start: datetime.datetime, window_end: datetime.datetime, approximate: bool = False) -> str:
+    key = f"{window_start:%Y%m%dT%H%M%S%z}_{window_end:%Y%m%dT%H%M%S%z}"
+    # approximate distinct counts are cached apart from the exact ones
+    return f"{key}_approx" if approximate else key
+
+
+class ResultsCache:
+    """
+    Analytics results per (result name, window), namespaced by dataset version so a refresh never
+    serves stale results. The standard windows are persisted by `warm-cache` with `put`, anything
+    else `cached` computes is kept in a bounded in-memory LRU.
+    """
+
+    def __init__(self, version: str, root: Path = CACHE_DIR):
+        self.version = version
+        self.root = root
+        self.dir = root / version
+        # sessions asking for the same result at once wait on a single computation of it
+        self.flights = SingleFlight(f"results-{version}")
+        self._memory: "OrderedDict[t.Tuple[str, str], t.Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def path(self, name: str, key: str) -> Path:
+        return self.dir / f"{name}-{key}.pkl"
+
+    def get(self, name: str, key: str) -> t.Optional[t.Any]:
+        try:
+            with open(self.path(name, key), "rb") as f:
+                return pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def put(self, name: str, key: str, value: t.Any) -> None:
+        self.dir.mkdir(parents=True, exist_ok=True)
+        # write then rename so readers never see a partial file
+        with tempfile.NamedTemporaryFile(dir=self.dir, delete=False) as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f.name, self.path(name, key))
+
+    def cached(self, name: str, key: str, f: t.Callable[..., t.Any], *args: t.Any, **kwargs: t.Any) -> t.Any:
+        with self._lock:
+            if (name, key) in self._memory:
+                self._memory.move_to_end((name, key))
+                return self._memory[(name, key)]
+
+        value = self.get(name, key)
+        if value is None:
+            value = self.flights.do((name, key), f, *args, **kwargs)
+
+        with self._lock:
+            self._memory[(name, key)] = value
+            if len(self._memory) > MEMORY_ENTRIES:
+                self._memory.popitem(last=False)
+        return value
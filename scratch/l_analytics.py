@@ -17,7 +17,7 @@ def gen_cohort_analysis(
 ) -> dp.Group:
     df_orders_cohort = df_orders_window
 
-    df_orders_cohort["order_month"] = df_orders_cohort["Created at"].apply(a.get_month)
+    df_orders_cohort["order_month"] = a.order_months(df_orders_cohort["Created at"])
 
     grouping = df_orders_cohort.groupby("Cust_ID")["order_month"]
 
@@ -0,0 +1,128 @@
+"""
+RFM segmentation and a simple customer lifetime value estimate.
+
+Every customer with an order gets recency / frequency / monetary scores from 1 to 5 and a segment
+from the classic R x F grid. Recency and monetary are scored on dense ranks across the whole
+customer base and frequency on fixed order count bands, so customers with the same values always
+share a score, at the cost of uneven bands (most customers have a single order).
+CLV is the historical average order value times the customer's order rate, over LIFESPAN_YEARS.
+
+Everything is computed for all customers at once from grouped aggregates over the orders,
+once per snapshot, so a window only has to select the customers active in it.
+"""
+import dataclasses as dc
+import typing as t
+
+import numpy as np
+import pandas as pd
+
+SCORES = 5
+# expected remaining customer lifetime, and the shortest history an order rate is taken over
+LIFESPAN_YEARS = 3
+MIN_HISTORY_DAYS = 365
+# lowest order count of each frequency score: 1 / 2 / 3 / 4-5 / 6+
+FREQUENCY_BANDS = np.array([1, 2, 3, 4, 6])
+
+# (segment, recency scores, frequency scores) - together they tile the 5x5 R x F grid
+SEGMENTS = [
+    ("Champions", (5,), (4, 5)),
+    ("Loyal Customers", (3, 4), (4, 5)),
+    ("Potential Loyalists", (4, 5), (2, 3)),
+    ("New Customers", (5,), (1,)),
+    ("Promising", (4,), (1,)),
+    ("Need Attention", (3,), (3,)),
+    ("About to Sleep", (3,), (1, 2)),
+    ("Can't Lose", (1, 2), (5,)),
+    ("At Risk", (1, 2), (3, 4)),
+    ("Hibernating", (1, 2), (1, 2)),
+]
+SEGMENT_NAMES = [name for name, _, _ in SEGMENTS]
+
+
+def _segment_grid() -> np.ndarray:
+    grid = np.full((SCORES, SCORES), -1, dtype=np.int8)
+    for code, (_, recency, frequency) in enumerate(SEGMENTS):
+        grid[np.ix_(np.array(recency) - 1, np.array(frequency) - 1)] = code
+    assert (grid >= 0).all(), "segments must cover every R x F cell"
+    return grid
+
+
+SEGMENT_GRID = _segment_grid()
+
+
+def score(values: pd.Series, ascending: bool = True) -> pd.Series:
+    """Score from 1 to 5 on the dense rank of the values, so equal values get equal scores"""
+    pct = values.rank(method="dense", pct=True, ascending=ascending)
+    return np.ceil(pct * SCORES).clip(1, SCORES).astype(np.int8)
+
+
+def frequency_score(frequency: pd.Series) -> pd.Series:
+    """Score from 1 to 5 from the `FREQUENCY_BANDS` the order counts fall in"""
+    return pd.Series(np.searchsorted(FREQUENCY_BANDS, frequency, side="right"), index=frequency.index, dtype=np.int8)
+
+
+def rfm(df_orders: pd.DataFrame, as_of: t.Optional[pd.Timestamp] = None) -> pd.DataFrame:
+    """Per customer RFM metrics, scores, segment and CLV, indexed by Cust_ID"""
+    as_of = df_orders["Created at"].max() if as_of is None else as_of
+
+    customers = (
+        df_orders[df_orders["Cust_ID"].notna()]
+        .groupby("Cust_ID", sort=False)
+        .agg(
+            first_order=("Created at", "min"),
+            last_order=("Created at", "max"),
+            frequency=("Created at", "size"),
+            monetary=("Total", "sum"),
+        )
+    )
+
+    customers["recency"] = (as_of - customers["last_order"]).dt.days
+    customers["avg_order"] = customers["monetary"] / customers["frequency"]
+
+    # more recent is better, so the fewest days since the last order scores highest
+    customers["r_score"] = score(customers["recency"], ascending=False)
+    customers["f_score"] = frequency_score(customers["frequency"])
+    customers["m_score"] = score(customers["monetary"])
+    customers["segment"] = pd.Categorical.from_codes(
+        SEGMENT_GRID[customers["r_score"] - 1, customers["f_score"] - 1], categories=SEGMENT_NAMES
+    )
+
+    # orders per year over at least a year of history, so recent customers aren't annualised from a few weeks
+    history_days = np.maximum((as_of - customers["first_order"]).dt.days, MIN_HISTORY_DAYS)
+    customers["orders_per_year"] = customers["frequency"] / history_days * 365
+    customers["clv"] = customers["avg_order"] * customers["orders_per_year"] * LIFESPAN_YEARS
+
+    return customers
+
+
+@dc.dataclass
+class Segments:
+    """RFM / CLV for every customer of a snapshot, scored as of its latest order"""
+
+    as_of: pd.Timestamp
+    customers: pd.DataFrame
+
+    @classmethod
+    def build(cls, df_orders: pd.DataFrame) -> "Segments":
+        as_of = df_orders["Created at"].max()
+        return cls(as_of, rfm(df_orders, as_of))
+
+    def window(self, df_orders_window: pd.DataFrame) -> pd.DataFrame:
+        """The customers with an order in the window"""
+        # the index's hash table is built once and reused, so this is just a lookup per customer
+        pos = self.customers.index.get_indexer(pd.unique(df_orders_window["Cust_ID"].dropna()))
+        return self.customers.iloc[pos[pos >= 0]]
+
+
+def summary(customers: pd.DataFrame) -> pd.DataFrame:
+    """Size, RFM averages and CLV of each segment, in `SEGMENTS` order"""
+    by_segment = customers.groupby("segment", observed=False).agg(
+        customers=("frequency", "size"),
+        recency=("recency", "mean"),
+        frequency=("frequency", "mean"),
+        monetary=("monetary", "mean"),
+        avg_clv=("clv", "mean"),
+        total_clv=("clv", "sum"),
+    )
+    by_segment.insert(1, "share", by_segment["customers"] / max(len(customers), 1))
+    return by_segment
@@ -0,0 +1,79 @@
+import concurrent.futures as cf
+import logging
+import threading
+import typing as t
+
+log = logging.getLogger(__name__)
+
+T = t.TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key - the first caller runs the function and
+    everyone arriving while it's in flight waits for, and shares, its result (or exception).
+
+    `on_result(result, callers)` is called by the first caller once the key has left the flight,
+    before anyone else sees the result, so the count of callers sharing it is final.
+    """
+
+    def __init__(self, name: str, on_result: t.Optional[t.Callable[[t.Any, int], None]] = None):
+        self.name = name
+        self.on_result = on_result
+        self._lock = threading.Lock()
+        self._in_flight: t.Dict[t.Hashable, cf.Future] = {}
+        # callers of each in-flight key, the first one included
+        self._callers: t.Dict[t.Hashable, int] = {}
+        self.requests = 0
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key: t.Hashable, f: t.Callable[..., T], *args: t.Any, **kwargs: t.Any) -> T:
+        with self._lock:
+            self.requests += 1
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                self._callers[key] += 1
+                leader = False
+            else:
+                self.executed += 1
+                future = self._in_flight[key] = cf.Future()
+                self._callers[key] = 1
+                leader = True
+
+        if not leader:
+            log.info(f"{self.name}: coalesced request for {key} ({self.coalesced}/{self.requests} so far)")
+            return future.result()
+
+        try:
+            result = f(*args, **kwargs)
+        except BaseException as e:
+            self._land(key)
+            future.set_exception(e)
+            raise
+
+        callers = self._land(key)
+        try:
+            if self.on_result is not None:
+                self.on_result(result, callers)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+    def _land(self, key: t.Hashable) -> int:
+        # later callers start a new flight, so nobody else can join this one
+        with self._lock:
+            del self._in_flight[key]
+            return self._callers.pop(key)
+
+    def stats(self) -> t.Dict[str, int]:
+        with self._lock:
+            return dict(
+                requests=self.requests,
+                executed=self.executed,
+                coalesced=self.coalesced,
+                in_flight=len(self._in_flight),
+            )
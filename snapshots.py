@@ -0,0 +1,206 @@
+import dataclasses as dc
+import datetime
+import os
+import shutil
+import threading
+import typing as t
+from functools import cached_property
+from pathlib import Path
+
+import pandas as pd
+
+import dataset
+import db
+import sketches as sk
+from cohorts import CohortStore
+from db import ConnectionPool
+from order_index import OrderIndex
+from results_cache import CACHE_DIR, ResultsCache
+from segmentation import Segments
+from zipcodes import ZipcodeLookup
+
+SNAPSHOT_DIR = Path(os.environ.get("SNAPSHOT_DIR", "data/snapshots"))
+CURRENT_FILE = "CURRENT"
+# the current snapshot plus the one before it, for readers that haven't switched over yet
+KEEP = 2
+
+FRAMES = ("orders", "items", "customers")
+ZIPCODE_LOOKUP_DIR = "zipcode_lookup"
+DB_FILE = "data.db"
+COHORTS_FILE = "cohorts.pkl"
+
+
+@dc.dataclass
+class Snapshot:
+    """An immutable, versioned copy of the dataset along with everything derived from it"""
+
+    version: str
+    df_orders: pd.DataFrame
+    df_items: pd.DataFrame
+    df_customers: pd.DataFrame
+    zipcode_lookup: ZipcodeLookup
+    # opened / read along with the frames, so requests still being served from this snapshot keep
+    # working once `gc` removes its files. The database is read-only, so queries never wait on
+    # `update-db` writing the next snapshot
+    db: t.Optional[ConnectionPool] = None
+    stored_cohorts: t.Optional[CohortStore] = None
+
+    @classmethod
+    def load(cls, version: str, root: Path = SNAPSHOT_DIR) -> "Snapshot":
+        path = root / version
+        frames = [pd.read_pickle(path / f"{name}.pkl") for name in FRAMES]
+        zipcode_lookup = ZipcodeLookup.load(path / ZIPCODE_LOOKUP_DIR)
+        db_file, cohorts_file = path / DB_FILE, path / COHORTS_FILE
+        return cls(
+            version,
+            *frames,
+            zipcode_lookup,
+            db=ConnectionPool(db_file) if db_file.exists() else None,
+            stored_cohorts=CohortStore.load(cohorts_file) if cohorts_file.exists() else None,
+        )
+
+    @classmethod
+    def from_source(cls) -> "Snapshot":
+        # no snapshot published yet, fall back to the CSVs in the data dir
+        return cls(dataset.version(), *dataset.load())
+
+    @cached_property
+    def results(self) -> ResultsCache:
+        return ResultsCache(self.version)
+
+    @cached_property
+    def order_index(self) -> OrderIndex:
+        return OrderIndex.build(self.df_items)
+
+    @cached_property
+    def cohort_store(self) -> CohortStore:
+        return self.stored_cohorts if self.stored_cohorts is not None else CohortStore.build(self.df_orders)
+
+    @cached_property
+    def segments(self) -> Segments:
+        return Segments.build(self.df_orders)
+
+    @cached_property
+    def customer_sketches(self) -> sk.DailySketches:
+        return sk.DailySketches.build(self.df_orders, "Created at", "Cust_ID")
+
+
+################################################################################
+# Publishing
+def publish(
+    df_orders: pd.DataFrame,
+    df_items: pd.DataFrame,
+    df_customers: pd.DataFrame,
+    zipcode_lookup: ZipcodeLookup,
+    cohort_store: t.Optional[CohortStore] = None,
+    root: Path = SNAPSHOT_DIR,
+) -> str:
+    """Build a new snapshot alongside the current one, then atomically make it current"""
+    version = f"{datetime.datetime.utcnow():%Y%m%dT%H%M%S}-{dataset.version()}"
+    build_dir = root / f".{version}.tmp"
+    shutil.rmtree(build_dir, ignore_errors=True)
+    build_dir.mkdir(parents=True)
+
+    for name, df in zip(FRAMES, (df_orders, df_items, df_customers)):
+        df.to_pickle(build_dir / f"{name}.pkl")
+    zipcode_lookup.save(build_dir / ZIPCODE_LOOKUP_DIR)
+    if cohort_store is not None:
+        cohort_store.save(build_dir / COHORTS_FILE)
+    df_zipcode_lookup = zipcode_lookup.to_frame()
+
+    con = db.connect(build_dir / DB_FILE, read_only=False)
+    con.execute("SET pandas_analyze_sample=100000")
+    con.execute("CREATE TABLE orders AS SELECT * FROM df_orders")
+    con.execute("CREATE TABLE items AS SELECT * FROM df_items")
+    con.execute("CREATE TABLE customers AS SELECT * FROM df_customers")
+    con.execute("CREATE TABLE zipcode_lookup AS SELECT * FROM df_zipcode_lookup")
+    con.close()
+
+    # the snapshot is complete, move it into place and swap the pointer
+    os.replace(build_dir, root / version)
+    _atomic_write(root / CURRENT_FILE, version)
+    # keep the `data/data.db` path used by the package config pointing at the current database
+    _atomic_symlink((root / version / DB_FILE).resolve(), dataset.DATA_DIR / DB_FILE)
+
+    gc(root)
+    return version
+
+
+def gc(root: Path = SNAPSHOT_DIR, keep: int = KEEP) -> None:
+    """Remove all but the newest `keep` snapshots, never the current one, and any results not cached for those"""
+    kept = kept_versions(root, keep)
+    for path in root.iterdir():
+        if path.is_dir() and not path.name.startswith(".") and path.name not in kept:
+            shutil.rmtree(path, ignore_errors=True)
+
+    # including the results cached against the CSVs before the first snapshot was published
+    prune(CACHE_DIR, kept)
+
+
+def kept_versions(root: Path = SNAPSHOT_DIR, keep: int = KEEP) -> t.Set[str]:
+    """The newest `keep` snapshots and the current one, everything else is removed by `gc`"""
+    if not root.exists():
+        return set()
+    versions = sorted(p.name for p in root.iterdir() if p.is_dir() and not p.name.startswith("."))
+    return set(versions[-keep:]) | {current_version(root)}
+
+
+def prune(path: Path, kept: t.Set[str]) -> None:
+    """Remove the entries of a per-version directory for any version not in `kept`"""
+    if path.exists():
+        for version_path in path.iterdir():
+            if version_path.name in kept:
+                continue
+            if version_path.is_dir():
+                shutil.rmtree(version_path, ignore_errors=True)
+            else:
+                version_path.unlink(missing_ok=True)
+
+
+def current_version(root: Path = SNAPSHOT_DIR) -> t.Optional[str]:
+    try:
+        return (root / CURRENT_FILE).read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _atomic_write(path: Path, content: str) -> None:
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(content)
+    os.replace(tmp, path)
+
+
+def _atomic_symlink(target: Path, link: Path) -> None:
+    tmp = link.with_name(f".{link.name}.tmp")
+    tmp.unlink(missing_ok=True)
+    tmp.symlink_to(target)
+    os.replace(tmp, link)
+
+
+################################################################################
+# Reading
+_current: t.Optional[Snapshot] = None
+_lock = threading.Lock()
+
+
+def current(root: Path = SNAPSHOT_DIR) -> Snapshot:
+    """
+    The latest published snapshot, reloaded when the pointer moves.
+    Callers should fetch it once per request and use that reference throughout,
+    so an in-flight request finishes on the version it started with.
+    """
+    global _current
+    version = current_version(root)
+    snapshot = _current
+    if snapshot is not None and (version is None or snapshot.version == version):
+        return snapshot
+
+    # only one thread loads a new version, everyone else keeps using the old one until it's ready
+    if not _lock.acquire(blocking=snapshot is None):
+        return snapshot
+    try:
+        if _current is None or (version is not None and _current.version != version):
+            _current = Snapshot.load(version, root) if version else Snapshot.from_source()
+        return _current
+    finally:
+        _lock.release()
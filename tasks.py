@@ -1,56 +1,114 @@
-import datapane as dp
-from pathlib import Path
+import datetime
+import logging
 
-import pandas as pd
-import duckdb
+import datapane as dp
 
 import analytics as a
-import json
-from datapane_components import section
+import blocks
+import cohorts
+import dataset
+import profiling
+import reports
+import segmentation
+import snapshots
+from results_cache import window_key
+from snapshots import Snapshot
+
+log = logging.getLogger(__name__)
 
 
 @dp.task(name="update-db")
+@profiling.profiled("update_db")
 def update_db():
     # Load data via Singer / Meltano
     # load_data = subprocess.Popen("tap-shopify --config tap_config.json --catalog catalog.json | target-duckdb --config target_config.json >> state.json",
     #                              shell=True)
 
     # use local CSVs
-    df_orders = pd.read_csv("data/order.csv").set_index("Name")
-    df_items = pd.read_csv("data/items.csv", low_memory=False).set_index("Name")
-    df_customers = pd.read_csv("data/cust.csv").set_index("Cust_ID")
-
-    with open("data/zipcode_lookup.json", "r") as f:
-        zipcode_lookup = json.load(f)
-        df_zipcode_lookup = pd.DataFrame(zipcode_lookup).T
-    # make our `datetime`s aware of the time zone.
-    a.set_timezones(df_orders, ["Created at"])
-    a.set_timezones(df_items, ["Created at"])
-    a.set_timezones(df_customers, ["first_order", "last_order"])
-
-    # load as tables into duck
-    Path("data.db").unlink(missing_ok=True)
-    duckdb.default_connection.execute("SET GLOBAL pandas_analyze_sample=100000")
-    con = duckdb.connect("data.db")
-    con.execute("CREATE TABLE orders AS SELECT * FROM df_orders")
-    con.execute("CREATE TABLE items AS SELECT * FROM df_items")
-    con.execute("CREATE TABLE customers AS SELECT * FROM df_customers")
-    con.execute("CREATE TABLE zipcode_lookup AS SELECT * FROM df_zipcode_lookup")
+    df_orders, df_items, df_customers, zipcode_lookup = dataset.load()
+
+    # carry the closed cohort months over from the live snapshot, only the newly closed ones are computed
+    cohort_store = snapshots.current().cohort_store.update(df_orders)
+
+    # build a new snapshot (frames + duck tables) next to the live one and swap it in,
+    # running apps pick it up on their next request
+    snapshots.publish(df_orders, df_items, df_customers, zipcode_lookup, cohort_store)
+
+    # precompute the common windows so the first visitor after a refresh doesn't pay for them
+    warm_results_cache(snapshots.current())
+
+
+@profiling.profiled("warm_results_cache")
+def warm_results_cache(snap: Snapshot) -> None:
+    for start_date, end_date, all_data in a.standard_windows(datetime.date.today()):
+        window_start, window_end = a.resolve_window(snap.df_orders, start_date, end_date, all_data)
+        key = window_key(window_start, window_end)
+
+        (
+            df_orders_window,
+            df_orders_window_previous,
+            df_items_window,
+            _,
+            df_customers_window,
+            df_customers_window_previous,
+        ) = blocks.get_window_frames(snap, window_start, window_end)
+        if df_orders_window.empty:
+            continue
+
+        # as the app computes and looks them up, from the database when the snapshot has one
+        snap.results.put(
+            "summary_stats",
+            blocks.summary_key(window_start, window_end),
+            blocks.summary_stats(
+                snap,
+                df_orders_window,
+                df_customers_window,
+                df_orders_window_previous,
+                df_customers_window_previous,
+                window_start,
+                window_end,
+            ),
+        )
+        snap.results.put("product_combinations", key, a.product_combinations(df_items_window, snap.order_index))
+        snap.results.put(
+            "cohort_analysis",
+            key,
+            cohorts.cohort_analysis(snap.cohort_store, df_orders_window, window_start, window_end),
+        )
+
+
+@dp.task(name="warm-cache")
+def warm_cache():
+    warm_results_cache(snapshots.current())
 
 
 @dp.task(name="daily-report")
+@profiling.profiled("daily_report")
 def daily_report():
-    report = dp.Group(
-        "## Summary",
-        a.gen_summary_stats(),
-        *section("## Top Products"),
-        a.gen_top_product_stats(),
-        a.gen_audiencce_plots(),
-        label="Top Stats",
-    )
-
-    dp.save_report(report, name="daily_report.html")
-
-    # send report via slack and email
-    dp.notification.slack(channel="#updates", file="daily_report.html")
-    dp.notification.email(addresses=["leo@example.com", "mg@example.com"], file="daily_report.html")
+    # last 7 / 30 days for everyone, and the last 30 days of each customer segment,
+    # reusing the results precomputed by `warm-cache`
+    today = datetime.date.today()
+    last_7_days, last_30_days = today - datetime.timedelta(days=7), today - datetime.timedelta(days=30)
+    specs = [
+        reports.ReportSpec("daily_report_7_days", last_7_days, today),
+        reports.ReportSpec("daily_report", last_30_days, today),
+    ]
+
+    # dormant segments (e.g. "Hibernating") have no recent orders by definition, so there's nothing to report
+    snaps, skipped = reports.segment_snapshots(snapshots.current(), segmentation.SEGMENT_NAMES), []
+    for segment in segmentation.SEGMENT_NAMES:
+        spec = reports.ReportSpec(f"daily_report_{reports.slugify(segment)}", last_30_days, today, segment=segment)
+        if reports.has_orders(snaps[segment], spec):
+            specs.append(spec)
+        else:
+            skipped.append(spec)
+
+    results = reports.generate(specs, snaps=snaps)
+    for result in results:
+        if result.file is None:
+            log.error(f"Report {result.spec.name} wasn't sent: {result.error}")
+
+    # send the batch via slack and email, one archive with a summary of anything missing from it
+    archive = reports.bundle(results, f"daily_reports_{today:%Y-%m-%d}", skipped)
+    dp.notification.slack(channel="#updates", file=str(archive))
+    dp.notification.email(addresses=["leo@example.com", "mg@example.com"], file=str(archive))
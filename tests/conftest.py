@@ -0,0 +1,16 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+ROOT = Path(__file__).parents[1]
+sys.path.insert(0, str(ROOT))
+
+
+@pytest.fixture(scope="session")
+def df_orders() -> pd.DataFrame:
+    # read directly rather than through `dataset`, which pulls in `analytics` and its locale
+    df = pd.read_csv(ROOT / "data" / "order.csv.gz", usecols=["Name", "Created at", "Cust_ID", "Total"])
+    df["Created at"] = pd.to_datetime(df["Created at"], utc=True, errors="coerce")
+    return df.set_index("Name")
@@ -0,0 +1,51 @@
+import logging
+
+import altair as alt
+import numpy as np
+import pandas as pd
+import pytest
+
+import chart_data as cd
+
+
+def test_reordered_rows_are_not_shared():
+    df = pd.DataFrame({"unique_values": ["Monday", "Tuesday", "Wednesday"], "counts": [1, 2, 3]})
+    reordered = df.iloc[[2, 0, 1]].reset_index(drop=True)
+
+    assert cd.to_compact_values(df)["values"][0]["unique_values"] == "Monday"
+    assert cd.to_compact_values(reordered)["values"][0]["unique_values"] == "Wednesday"
+
+
+def test_key_includes_dtypes():
+    df = pd.DataFrame({"counts": [1, 2, 3]})
+    assert cd.dataset_key(df) == cd.dataset_key(df.copy())
+    assert cd.dataset_key(df) != cd.dataset_key(df.astype(float))
+
+
+def test_row_level_frames_are_rejected():
+    df = pd.DataFrame({"counts": range(11)})
+    with pytest.raises(alt.MaxRowsError):
+        cd.to_compact_values(df, max_rows=10)
+
+
+def test_compact_frame():
+    df = pd.DataFrame({"total": [1.23456, 2.5], "counts": [1.0, 2.0], "missing": [1.0, None], "name": ["a", "b"]})
+    compact = cd.compact_frame(df)
+
+    assert compact["total"].tolist() == [1.23, 2.5]
+    assert compact["counts"].dtype == np.int64
+    # NaNs can't be narrowed to ints
+    assert compact["missing"].dtype == np.float64
+    pd.testing.assert_series_equal(compact["name"], df["name"])
+
+
+def test_over_budget_payload_warns(caplog):
+    df = pd.DataFrame({"counts": range(100)})
+    with caplog.at_level(logging.WARNING, logger=cd.log.name):
+        cd.to_compact_values(df, budget=10)
+    assert "over the 10 byte budget" in caplog.text
+
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger=cd.log.name):
+        cd.to_compact_values(pd.DataFrame({"counts": range(3)}))
+    assert not caplog.records
@@ -0,0 +1,48 @@
+import datetime
+import locale
+
+import pandas as pd
+import pytest
+
+try:
+    import analytics as a
+    import cohorts
+except locale.Error:
+    pytest.skip("analytics needs the en_US.UTF-8 locale", allow_module_level=True)
+
+
+def test_all_data_reads_the_store(df_orders, monkeypatch):
+    store = cohorts.CohortStore.build(df_orders)
+    window_start, window_end = a.resolve_window(df_orders, None, None, all_data=True)
+    df_orders_window, _ = a.get_window(df_orders, "Created at", window_start, window_end)
+    assert store.covers(window_start, window_end)
+
+    reads = []
+    read = cohorts.CohortStore.read
+    monkeypatch.setattr(cohorts.CohortStore, "read", lambda self, df: reads.append(df) or read(self, df))
+    monkeypatch.setattr(a, "plot_cohorts", lambda retention, average_order: (retention, average_order))
+
+    retention, average_order = cohorts.cohort_analysis(store, df_orders_window, window_start, window_end)
+    assert len(reads) == 1
+
+    expected_retention, expected_average_order = a.cohort_matrices(a.cohort_cells(df_orders_window))
+    pd.testing.assert_frame_equal(retention, expected_retention, check_dtype=False)
+    pd.testing.assert_frame_equal(average_order, expected_average_order, check_dtype=False)
+
+
+def test_other_windows_are_computed(df_orders):
+    store = cohorts.CohortStore.build(df_orders)
+    end = df_orders["Created at"].max().date()
+    window_start, window_end = a.resolve_window(df_orders, end - datetime.timedelta(weeks=26), end, all_data=False)
+    assert not store.covers(window_start, window_end)
+
+
+def test_update_only_adds_closed_months(df_orders):
+    months = a.order_months(df_orders["Created at"])
+    cutoff = months.drop_duplicates().sort_values().iloc[len(months.unique()) // 2]
+    store = cohorts.CohortStore.build(df_orders[months < cutoff]).update(df_orders)
+    full = cohorts.CohortStore.build(df_orders)
+
+    assert store.closed == full.closed
+    pd.testing.assert_frame_equal(store.cells, full.cells, check_dtype=False)
+    pd.testing.assert_series_equal(store.month_orders, full.month_orders)
@@ -0,0 +1,49 @@
+import datetime
+import locale
+
+import pandas as pd
+import pytest
+
+import db
+from conftest import ROOT
+
+try:
+    import analytics as a
+except locale.Error:
+    pytest.skip("analytics needs the en_US.UTF-8 locale", allow_module_level=True)
+
+
+@pytest.fixture(scope="module")
+def frames(tmp_path_factory):
+    df_orders = pd.read_csv(
+        ROOT / "data" / "order.csv.gz", usecols=["Name", "Created at", "Cust_ID", "Total", "Financial Status"]
+    ).set_index("Name")
+    df_customers = pd.read_csv(ROOT / "data" / "cust.csv.gz", usecols=["Cust_ID", "first_order"]).set_index("Cust_ID")
+    a.set_timezones(df_orders, ["Created at"])
+    a.set_timezones(df_customers, ["first_order"])
+
+    db_file = tmp_path_factory.mktemp("db") / "data.db"
+    con = db.connect(db_file, read_only=False)
+    con.execute("CREATE TABLE orders AS SELECT * FROM df_orders")
+    con.execute("CREATE TABLE customers AS SELECT * FROM df_customers")
+    con.close()
+
+    pool = db.ConnectionPool(db_file)
+    yield df_orders, df_customers, pool
+    pool.close()
+
+
+@pytest.mark.parametrize("start_date, end_date, all_data", a.standard_windows(datetime.date(2021, 6, 1)))
+def test_summary_stats(frames, start_date, end_date, all_data):
+    df_orders, df_customers, pool = frames
+    window_start, window_end = a.resolve_window(df_orders, start_date, end_date, all_data)
+    df_orders_window, df_orders_window_previous = a.get_window(df_orders, "Created at", window_start, window_end)
+    df_customers_window, df_customers_window_previous = a.get_window(
+        df_customers, "first_order", window_start, window_end
+    )
+
+    expected = a.get_summary_stats(
+        df_orders_window, df_customers_window, df_orders_window_previous, df_customers_window_previous
+    )
+    for stats, expected_stats in zip(a.compare_periods(*pool.summary_stats(window_start, window_end)), expected):
+        pd.testing.assert_frame_equal(stats, expected_stats)
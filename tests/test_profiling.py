@@ -0,0 +1,48 @@
+import pstats
+
+import profiling
+
+
+def test_nested_calls_are_captured_by_the_outer_profile(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "ENABLED", True)
+    monkeypatch.setattr(profiling, "MODE", "deterministic")
+    monkeypatch.setattr(profiling, "PROFILE_DIR", tmp_path)
+
+    def after_inner() -> None:
+        pass
+
+    @profiling.profiled("inner")
+    def inner() -> None:
+        pass
+
+    @profiling.profiled("outer")
+    def outer() -> None:
+        inner()
+        after_inner()
+
+    with profiling.profile_request():
+        outer()
+
+    (prof,) = tmp_path.glob("*.prof")
+    assert prof.name.startswith("outer-")
+    called = {func for _, _, func in pstats.Stats(str(prof)).stats}
+    assert {"inner", "after_inner"} <= called
+
+
+def test_profile_window(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "ENABLED", True)
+    monkeypatch.setattr(profiling, "PROFILE_DIR", tmp_path)
+    monkeypatch.setattr(profiling, "WINDOWS", frozenset({"slow_window"}))
+
+    @profiling.profiled("render_window")
+    def render_window() -> None:
+        pass
+
+    with profiling.profile_window("other_window"):
+        render_window()
+    assert not list(tmp_path.iterdir())
+
+    with profiling.profile_window("slow_window"):
+        render_window()
+    (meta,) = tmp_path.glob("render_window-*.json")
+    assert '"window": "slow_window"' in meta.read_text()
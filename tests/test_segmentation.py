@@ -0,0 +1,38 @@
+import pandas as pd
+import pytest
+
+import segmentation as sg
+
+
+@pytest.fixture(scope="module")
+def customers(df_orders):
+    return sg.rfm(df_orders)
+
+
+@pytest.mark.parametrize("col", ["r_score", "f_score", "m_score"])
+def test_scores_in_range(customers, col):
+    assert customers[col].between(1, sg.SCORES).all()
+
+
+@pytest.mark.parametrize("value, col", [("recency", "r_score"), ("frequency", "f_score"), ("monetary", "m_score")])
+def test_tied_customers_share_a_score(customers, value, col):
+    assert (customers.groupby(value)[col].nunique() == 1).all()
+
+
+def test_tied_customers_share_a_segment(customers):
+    assert list(customers["segment"].cat.categories) == sg.SEGMENT_NAMES
+    assert (customers.groupby(["recency", "frequency"])["segment"].nunique() == 1).all()
+
+
+def test_score_ties():
+    values = pd.Series([1, 1, 1, 1, 1, 1, 1, 1, 2, 3])
+    scores = sg.score(values)
+    assert scores[values == 1].nunique() == 1
+    # higher values never score lower
+    assert scores[values == 3].min() > scores[values == 2].max() > scores[values == 1].max()
+    assert scores[values == 3].min() == sg.SCORES
+
+
+def test_frequency_bands():
+    frequency = pd.Series([1, 2, 3, 4, 5, 6, 20])
+    assert sg.frequency_score(frequency).tolist() == [1, 2, 3, 4, 4, 5, 5]
@@ -0,0 +1,48 @@
+import threading
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_on_result_counts_every_caller_before_they_return():
+    seen = []
+    flights = SingleFlight("test", on_result=lambda result, callers: seen.append((result, callers)))
+    started, finish = threading.Event(), threading.Event()
+
+    def work():
+        started.set()
+        finish.wait(5)
+        return "result"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do("key", work)))
+    leader.start()
+    started.wait(5)
+
+    followers = [threading.Thread(target=lambda: results.append(flights.do("key", work))) for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    while flights.stats()["coalesced"] < len(followers):
+        threading.Event().wait(0.01)
+    finish.set()
+    for thread in [leader, *followers]:
+        thread.join(5)
+
+    assert seen == [("result", 4)]
+    assert results == ["result"] * 4
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_failures_are_shared_and_not_counted():
+    seen = []
+    flights = SingleFlight("test", on_result=lambda result, callers: seen.append(callers))
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        flights.do("key", fail)
+    assert seen == []
+    assert flights.do("key", lambda: 1) == 1
+    assert seen == [1]
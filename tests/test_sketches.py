@@ -0,0 +1,36 @@
+import datetime
+
+import pytest
+
+import sketches as sk
+
+# ~95% of estimates land within two standard errors, see `sketches`
+BOUND = 2 * sk.RELATIVE_STD_ERROR
+
+
+@pytest.fixture(scope="module")
+def sketches(df_orders):
+    return sk.DailySketches.build(df_orders, "Created at", "Cust_ID")
+
+
+@pytest.mark.parametrize("days", [0.5, 1, 7, 30, 45, 182, 365, 3000])
+@pytest.mark.parametrize("tz", ["US/Pacific", "UTC"])
+def test_daily_sketches_count(df_orders, sketches, days, tz):
+    # window bounds at local midnight like the form's, so the edge days are partial unless in UTC
+    window_end = df_orders["Created at"].max().tz_convert(tz).normalize()
+    window_start = window_end - datetime.timedelta(days=days)
+    # as `analytics.get_window`
+    df_window = df_orders[(df_orders["Created at"] > window_start) & (df_orders["Created at"] < window_end)]
+
+    # the merged sketch is exactly the one built from the window's rows
+    expected = sk.build_registers(sk.hash_ids(df_window["Cust_ID"]))[0]
+    assert (sketches.registers(window_start, window_end) == expected).all()
+
+    exact = df_window["Cust_ID"].nunique()
+    estimate = sketches.count(window_start, window_end)
+    assert abs(estimate - exact) <= max(BOUND * exact, 1)
+
+
+def test_daily_sketches_count_empty(df_orders, sketches):
+    window_end = df_orders["Created at"].min()
+    assert sketches.count(window_end - datetime.timedelta(days=30), window_end) == 0
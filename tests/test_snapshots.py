@@ -0,0 +1,138 @@
+import locale
+import shutil
+
+import pandas as pd
+import pytest
+
+try:
+    import snapshots
+    from cohorts import CohortStore
+    from zipcodes import ZipcodeLookup
+except locale.Error:
+    pytest.skip("snapshots loads `analytics`, which needs the en_US.UTF-8 locale", allow_module_level=True)
+
+
+def make_versions(root, *versions):
+    for version in versions:
+        (root / version).mkdir(parents=True)
+
+
+def test_kept_versions(tmp_path):
+    assert snapshots.kept_versions(tmp_path / "missing") == set()
+
+    make_versions(tmp_path, "20230101T000000-a", "20230102T000000-b", "20230103T000000-c", ".20230104T000000-d.tmp")
+    (tmp_path / snapshots.CURRENT_FILE).write_text("20230101T000000-a")
+    assert snapshots.kept_versions(tmp_path, keep=2) == {
+        "20230101T000000-a",
+        "20230102T000000-b",
+        "20230103T000000-c",
+    }
+    assert snapshots.kept_versions(tmp_path, keep=1) == {"20230101T000000-a", "20230103T000000-c"}
+
+
+def test_prune(tmp_path):
+    make_versions(tmp_path, "old", "kept")
+    (tmp_path / "sales_report-old-window.html").write_text("")
+    snapshots.prune(tmp_path, {"kept"})
+    assert [path.name for path in tmp_path.iterdir()] == ["kept"]
+    snapshots.prune(tmp_path / "missing", {"kept"})
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    # keep `publish` / `gc` away from the repo's data dir and results cache
+    monkeypatch.setattr(snapshots.dataset, "DATA_DIR", tmp_path)
+    monkeypatch.setattr(snapshots, "CACHE_DIR", tmp_path / "cache")
+    monkeypatch.setattr(snapshots, "_current", None)
+    return tmp_path / "snapshots"
+
+
+@pytest.fixture(scope="module")
+def frames():
+    created = pd.to_datetime(["2023-01-01 10:00", "2023-01-02 10:00", "2023-01-02 11:00"], utc=True)
+    df_orders = pd.DataFrame(
+        {"Created at": created, "Cust_ID": [1, 2, 1], "Total": [10.0, 20.0, 30.0], "Financial Status": "paid"},
+        index=pd.Index(["#1", "#2", "#3"], name="Name"),
+    )
+    df_items = pd.DataFrame({"Lineitem name": ["Rose", "Tulip", "Rose"]}, index=df_orders.index)
+    df_customers = pd.DataFrame({"first_order": created[:2]}, index=pd.Index([1, 2], name="Cust_ID"))
+    zipcode_lookup = ZipcodeLookup.from_records(
+        {
+            "10001": {
+                "country_code": "US",
+                "state_name": "New York",
+                "place_name": "New York",
+                "latitude": 40.75,
+                "longitude": -73.99,
+            }
+        }
+    )
+    return df_orders, df_items, df_customers, zipcode_lookup
+
+
+def orders_per_day(snap):
+    window_start, window_end = pd.Timestamp("2022-12-01", tz="UTC"), pd.Timestamp("2023-02-01", tz="UTC")
+    return snap.db.orders_per_day(window_start, window_end)["Orders"].tolist()
+
+
+def copy_version(root, version, new_version):
+    # the same snapshot under another version, without its database
+    (root / new_version).mkdir()
+    for name in snapshots.FRAMES:
+        shutil.copy(root / version / f"{name}.pkl", root / new_version)
+    zipcode_lookup_dir = snapshots.ZIPCODE_LOOKUP_DIR
+    shutil.copytree(root / version / zipcode_lookup_dir, root / new_version / zipcode_lookup_dir)
+
+
+def test_publish(root, frames):
+    version = snapshots.publish(*frames, cohort_store=CohortStore.build(frames[0]), root=root)
+    assert snapshots.current_version(root) == version
+    assert [path.name for path in root.iterdir() if path.is_dir()] == [version]
+    db_link = snapshots.dataset.DATA_DIR / snapshots.DB_FILE
+    assert db_link.resolve() == (root / version / snapshots.DB_FILE).resolve()
+
+    snap = snapshots.current(root)
+    assert snap.version == version
+    pd.testing.assert_frame_equal(snap.df_orders, frames[0])
+    assert orders_per_day(snap) == [1, 2]
+    assert snap.stored_cohorts is not None
+
+
+def test_current_reloads_when_the_pointer_moves(root, frames):
+    version = snapshots.publish(*frames, root=root)
+    snap = snapshots.current(root)
+    assert snapshots.current(root) is snap
+
+    copy_version(root, version, "20990101T000000-b")
+    (root / snapshots.CURRENT_FILE).write_text("20990101T000000-b")
+    reloaded = snapshots.current(root)
+    assert reloaded.version == "20990101T000000-b"
+    assert reloaded.db is None
+    assert snapshots.current(root) is reloaded
+
+
+def test_gc(root):
+    make_versions(root, "20230101T000000-a", "20230102T000000-b", "20230103T000000-c", ".20230104T000000-d.tmp")
+    make_versions(snapshots.CACHE_DIR, "20230101T000000-a", "20230103T000000-c")
+    (root / snapshots.CURRENT_FILE).write_text("20230102T000000-b")
+
+    snapshots.gc(root, keep=1)
+    assert sorted(path.name for path in root.iterdir()) == [
+        ".20230104T000000-d.tmp",
+        "20230102T000000-b",
+        "20230103T000000-c",
+        snapshots.CURRENT_FILE,
+    ]
+    assert [path.name for path in snapshots.CACHE_DIR.iterdir()] == ["20230103T000000-c"]
+
+
+def test_snapshot_outlives_gc(root, frames):
+    # a request still holding the previous snapshot keeps querying it after `gc` removes its files
+    version = snapshots.publish(*frames, root=root)
+    snap = snapshots.Snapshot.load(version, root)
+    copy_version(root, version, "20990101T000000-b")
+    (root / snapshots.CURRENT_FILE).write_text("20990101T000000-b")
+
+    snapshots.gc(root, keep=1)
+    assert not (root / version).exists()
+    assert orders_per_day(snap) == [1, 2]
@@ -0,0 +1,196 @@
+"""
+The app's form handler - renders the view for a window, streaming the heavy tabs in as they finish.
+
+Each request takes the current snapshot once and passes it through, so a refresh published by
+`update-db` is picked up without a restart while in-flight renders finish on the version they
+started with. Derived state (the order index, sketches and persisted results) lives on the
+snapshot and is dropped along with it.
+"""
+import concurrent.futures as cf
+import datetime
+import os
+import tempfile
+import threading
+import typing as t
+from pathlib import Path
+
+import datapane as dp
+
+import analytics as a
+import blocks
+import profiling
+import snapshots
+from results_cache import window_key
+from singleflight import SingleFlight
+from snapshots import Snapshot
+
+################################################################################
+# Progressive rendering
+# The heavy tabs are computed on a background pool and streamed into the view
+# once ready, so the summary isn't held up by apriori, the cohort plots, etc.
+render_pool = cf.ThreadPoolExecutor(max_workers=int(os.environ.get("RENDER_WORKERS", 4)), thread_name_prefix="render")
+
+
+def gen_deferred(name: str, label: str, future: cf.Future) -> dp.Group:
+    def on_load() -> dp.Group:
+        try:
+            return dp.Group(future.result(), name=name)
+        except cf.CancelledError:
+            return dp.Group("_Superseded by a newer submission._", name=name)
+
+    return dp.Group(
+        f"_Computing {label}..._",
+        dp.Dynamic(on_load=on_load, target=name),
+        name=name,
+    )
+
+
+class PendingTabs:
+    """
+    The deferred tabs of one render, shared by every session that was coalesced onto it -
+    they're only cancelled once none of those sessions are waiting on them any more.
+    """
+
+    def __init__(self, futures: t.List[cf.Future]):
+        self.futures = futures
+        self._subscribers = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, sessions: int = 1) -> "PendingTabs":
+        with self._lock:
+            self._subscribers += sessions
+        return self
+
+    def release(self) -> None:
+        with self._lock:
+            self._subscribers -= 1
+            if self._subscribers > 0:
+                return
+        # nobody is waiting, drop any work that hasn't started yet
+        self.cancel()
+
+    def cancel(self) -> None:
+        for future in self.futures:
+            future.cancel()
+
+
+def cancel_pending(session: t.Dict[str, t.Any]) -> None:
+    # a new window was submitted, release the tabs for the previous one
+    pending = session.pop("pending", None)
+    if pending is not None:
+        pending.release()
+
+
+################################################################################
+# Rendering
+# Concurrent submits of the same window (e.g. everyone opening a shared link) share one render,
+# every session coalesced onto it is subscribed to its tabs before any of them gets the view
+render_flights = SingleFlight("render", on_result=lambda result, sessions: result[1].subscribe(sessions))
+REPORT_DIR = Path(tempfile.gettempdir()) / "sales_reports"
+
+
+@profiling.profiled("standalone_report")
+def write_report(snap: Snapshot, key: str, summary: dp.Group, top_products: cf.Future) -> dp.Attachment:
+    """The standalone Top Stats report for download, once its top products are in"""
+    report = dp.Group(summary, top_products.result(), label="Top Stats")
+
+    report_dir = REPORT_DIR / snap.version
+    if not report_dir.exists():
+        # the first report since a swap, drop the ones for the snapshots `gc` has removed
+        snapshots.prune(REPORT_DIR, snapshots.kept_versions() | {snap.version})
+        report_dir.mkdir(parents=True, exist_ok=True)
+    # one report file per window, so concurrent renders of different windows don't overwrite each other
+    report_file = report_dir / f"sales_report-{key}.html"
+    dp.save_report(report, str(report_file))
+    return dp.Attachment(file=str(report_file))
+
+
+@profiling.profiled("render_window")
+def render_window(
+    snap: Snapshot, window_start: datetime.datetime, window_end: datetime.datetime
+) -> t.Tuple[dp.View, PendingTabs]:
+    key = window_key(window_start, window_end)
+    (
+        df_orders_window,
+        df_orders_window_previous,
+        df_items_window,
+        _,
+        df_customers_window,
+        df_customers_window_previous,
+    ) = blocks.get_window_frames(snap, window_start, window_end)
+
+    # kick off the heavy tabs (and the map in the top products) before building the summary
+    top_products = profiling.submit(
+        render_pool, blocks.gen_top_products, snap, df_items_window, df_orders_window, df_customers_window
+    )
+    popular_items = profiling.submit(render_pool, blocks.gen_popular_items, snap, df_items_window, key)
+    cohort_analysis = profiling.submit(
+        render_pool, blocks.gen_cohort_analysis, snap, df_orders_window, window_start, window_end, key
+    )
+    customer_segments = profiling.submit(render_pool, blocks.gen_customer_segments, snap, df_orders_window)
+    order_data = profiling.submit(render_pool, blocks.gen_order_data, df_orders_window)
+    futures = [top_products, popular_items, cohort_analysis, customer_segments, order_data]
+    pending = PendingTabs(futures)
+
+    try:
+        summary = dp.Group(
+            "## Summary",
+            blocks.gen_summary_stats(
+                snap,
+                df_orders_window,
+                df_customers_window,
+                df_orders_window_previous,
+                df_customers_window_previous,
+                window_start,
+                window_end,
+            ),
+        )
+        # submitted after the top products it waits on, so they're always picked up first and waiting
+        # on them never leaves it holding a worker they're queued behind
+        report = profiling.submit(render_pool, write_report, snap, key, summary, top_products)
+        futures.append(report)
+
+        tab1 = dp.Group(summary, gen_deferred("top-products", "top products", top_products), label="Top Stats")
+
+        tab2 = dp.Group(gen_deferred("popular-items", "popular items", popular_items), label="Popular Items")
+
+        tab3 = dp.Group(gen_deferred("cohort-analysis", "cohort analysis", cohort_analysis), label="Cohort Analysis")
+
+        tab4 = dp.Group(
+            gen_deferred("customer-segments", "customer segments", customer_segments), label="Customer Segments"
+        )
+
+        tab5 = dp.Group(
+            f"## Sales data for {window_start:%Y-%m-%d} to {window_end:%Y-%m-%d}",
+            gen_deferred("order-data", "order data", order_data),
+            label="Order Data",
+        )
+
+        view = dp.View(
+            dp.Toggle(
+                gen_deferred("standalone-report", "the standalone report", report),
+                name="download",
+                label="Download standalone Report",
+            ),
+            dp.Select(tab1, tab2, tab3, tab4, tab5, name="main_results"),
+        )
+    except BaseException:
+        # nobody will get these tabs
+        pending.cancel()
+        raise
+    return view, pending
+
+
+@profiling.profiled("render")
+def render(start_date: datetime.date, end_date: datetime.date, all_data: bool, session: t.Dict[str, t.Any]) -> dp.View:
+    cancel_pending(session)
+    snap = snapshots.current()
+
+    # get the data window, resolving "All Data" and the dates to the same bounds
+    window_start, window_end = a.resolve_window(snap.df_orders, start_date, end_date, all_data)
+    key = window_key(window_start, window_end)
+
+    # already subscribed for this session by the flight
+    with profiling.profile_window(key):
+        view, session["pending"] = render_flights.do((snap.version, key), render_window, snap, window_start, window_end)
+    return view
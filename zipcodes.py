@@ -0,0 +1,143 @@
+"""
+Prebuilt, columnar zipcode lookup.
+
+Build it once from the wrangled JSON (or re-query pgeocode with `--fetch`):
+
+    python zipcodes.py [--fetch]
+
+which writes `data/zipcode_lookup/` - one `.npy` per column plus the category labels -
+that the app memory maps at startup instead of parsing and transposing the JSON.
+"""
+import argparse
+import dataclasses as dc
+import json
+import time
+import typing as t
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+JSON_FILE = Path("data/zipcode_lookup.json")
+LOOKUP_DIR = Path("data/zipcode_lookup")
+CATEGORIES_FILE = "categories.json"
+
+KEY_WIDTH = 5
+CATEGORICAL_COLS = ("country_code", "state_name", "place_name")
+FLOAT_COLS = ("latitude", "longitude")
+
+
+def normalise(zips: pd.Series) -> pd.Series:
+    # Keep only the useful part of the zipcode
+    zips = zips.astype(str)
+    return zips.where(zips.str.len() == KEY_WIDTH, zips.str[:KEY_WIDTH])
+
+
+@dc.dataclass
+class ZipcodeLookup:
+    """
+    Row `i` of `frame` describes the postal code `keys[i]`, `keys` are sorted fixed-width bytes
+    so the integer zip key for any postal code is a binary search away.
+    """
+
+    keys: np.ndarray
+    frame: pd.DataFrame
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @classmethod
+    def from_records(cls, records: t.Mapping[str, t.Mapping[str, t.Any]]) -> "ZipcodeLookup":
+        df = pd.DataFrame.from_dict(records, orient="index")
+        df = df[~df.index.duplicated()].sort_index()
+        keys = df.index.to_numpy().astype(f"S{KEY_WIDTH}")
+
+        columns = {col: df[col].astype("category") for col in CATEGORICAL_COLS}
+        columns.update({col: pd.to_numeric(df[col]).astype(np.float32) for col in FLOAT_COLS})
+        frame = pd.DataFrame(columns).reset_index(drop=True).rename_axis("zip_key")
+        return cls(keys, frame)
+
+    @classmethod
+    def from_json(cls, path: Path = JSON_FILE) -> "ZipcodeLookup":
+        with open(path, "r") as f:
+            return cls.from_records(json.load(f))
+
+    @classmethod
+    def load(cls, path: Path = LOOKUP_DIR) -> "ZipcodeLookup":
+        with open(path / CATEGORIES_FILE, "r") as f:
+            categories = json.load(f)
+
+        def column(name: str) -> np.ndarray:
+            return np.load(path / f"{name}.npy", mmap_mode="r")
+
+        columns = {col: pd.Categorical.from_codes(column(col), categories=categories[col]) for col in CATEGORICAL_COLS}
+        columns.update({col: column(col) for col in FLOAT_COLS})
+        return cls(column("postal_code"), pd.DataFrame(columns).rename_axis("zip_key"))
+
+    def save(self, path: Path = LOOKUP_DIR) -> None:
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(path / "postal_code.npy", self.keys)
+        for col in CATEGORICAL_COLS:
+            np.save(path / f"{col}.npy", self.frame[col].cat.codes.to_numpy())
+        for col in FLOAT_COLS:
+            np.save(path / f"{col}.npy", self.frame[col].to_numpy(np.float32))
+        categories = {col: self.frame[col].cat.categories.tolist() for col in CATEGORICAL_COLS}
+        (path / CATEGORIES_FILE).write_text(json.dumps(categories))
+
+    def zip_keys(self, zips: pd.Series) -> np.ndarray:
+        """Integer zip key for each postal code, -1 where it isn't in the lookup"""
+        codes = normalise(zips.dropna()).to_numpy().astype(f"S{KEY_WIDTH}")
+        pos = np.minimum(np.searchsorted(self.keys, codes), len(self.keys) - 1)
+        return np.where(self.keys[pos] == codes, pos, -1)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Lookup with the postal codes as a column, e.g. for loading into a database"""
+        return self.frame.assign(postal_code=self.keys.astype(str)).reset_index()
+
+
+def fetch(postal_codes: t.Iterable[str]) -> t.Dict[str, t.Dict[str, t.Any]]:
+    """Geocode postal codes with pgeocode, trying the US first and then every other country"""
+    import pgeocode
+
+    countries = list(pgeocode.COUNTRIES_VALID)
+    countries.insert(0, countries.pop(countries.index("US")))
+
+    zipcode_lookup: t.Dict[str, t.Dict[str, t.Any]] = {}
+    for zipcode in sorted(set(postal_codes)):
+        for i in countries:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                result = pgeocode.Nominatim(i).query_postal_code(zipcode)
+            if not np.isnan(result["accuracy"]):
+                zipcode_lookup[zipcode] = result.replace(np.nan, None).to_dict()
+                break
+
+        if zipcode_lookup and len(zipcode_lookup) % 1000 == 0:
+            print(f"Sleeping for 3 seconds, {len(zipcode_lookup)} zipcodes processed")
+            time.sleep(3)
+    return zipcode_lookup
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build the columnar zipcode lookup")
+    parser.add_argument("--fetch", action="store_true", help="re-query pgeocode for the zipcodes in data/cust.csv.gz")
+    parser.add_argument("--json", type=Path, default=JSON_FILE)
+    parser.add_argument("--out", type=Path, default=LOOKUP_DIR)
+    args = parser.parse_args()
+
+    if args.fetch:
+        df = pd.read_csv("data/cust.csv.gz").dropna(subset=["Ship_Zip"])
+        records = fetch(normalise(df["Ship_Zip"]))
+        with open(args.json, "w") as f:
+            json.dump(records, f)
+        lookup = ZipcodeLookup.from_records(records)
+    else:
+        lookup = ZipcodeLookup.from_json(args.json)
+
+    lookup.save(args.out)
+    print(f"Wrote {len(lookup)} postal codes to {args.out}")
+
+
+if __name__ == "__main__":
+    main()